@@ -1,6 +1,9 @@
 from django.contrib import admin
+from django.db import transaction
 from unfold.admin import ModelAdmin
-from .models import Article, Comment, Upload
+from .models import Article, Comment, Upload, refresh_comment_counts
+from .dependencies import article_dependency
+from .pagecache import page_cache
 
 
 @admin.register(Article)
@@ -19,8 +22,16 @@ class CommentAdmin(ModelAdmin):
     actions = ["approve_comments"]
 
     def approve_comments(self, request, queryset):
+        article_ids = set(queryset.values_list("article_id", flat=True))
+
         queryset.update(active=True)
 
+        # `update` doesn't send `post_save`, so do what the signals would here.
+        refresh_comment_counts(*article_ids)
+        transaction.on_commit(
+            lambda: page_cache.invalidate(*map(article_dependency, article_ids))
+        )
+
 
 @admin.register(Upload)
 class UploadAdmin(ModelAdmin):
@@ -0,0 +1,260 @@
+"""
+Caching for rendered article content.
+
+Rendered HTML lives in a small in-process LRU in front of the ``render`` cache
+alias (an on-disk cache by default), so renders survive restarts and are shared
+between worker processes. The JSON-LD of articles is cached there too.
+"""
+
+from collections import OrderedDict
+from collections.abc import Sequence
+import hashlib
+import json
+import threading
+import time
+from typing import Any
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest
+
+RENDERER_VERSION = 3
+"""Bump this whenever the renderer output changes to invalidate every entry."""
+
+
+class RenderCache:
+    """
+    Rendered HTML keyed on article id.
+
+    Every entry stores the fingerprint of the input it was rendered from
+    (content hash, content type, renderer version and upload generation), so a
+    stale entry is never served even if an invalidation was missed.
+    """
+
+    UPLOADS_GENERATION_KEY = "uploads-generation"
+
+    def __init__(self, alias: str = "render", maxsize: int = 128):
+        self.alias = alias
+        self.maxsize = maxsize
+        self._local: OrderedDict[int, tuple[str, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def key(article_id: int) -> str:
+        return f"article:{article_id}"
+
+    def uploads_generation(self) -> int:
+        """
+        Changes whenever an upload changes, since `$ident` links may resolve differently.
+
+        Generations are timestamps rather than a counter starting at 0, so an
+        evicted generation gets a new value instead of going back to one old
+        entries were stored with.
+        """
+
+        return self.backend.get_or_set(
+            self.UPLOADS_GENERATION_KEY, time.time_ns, timeout=None
+        )
+
+    def fingerprint(self, content: str, content_type: int) -> str:
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+        return f"{RENDERER_VERSION}:{content_type}:{self.uploads_generation()}:{digest}"
+
+    def get(self, article_id: int, fingerprint: str) -> str | None:
+        with self._lock:
+            entry = self._local.get(article_id)
+
+            if entry is not None and entry[0] == fingerprint:
+                self._local.move_to_end(article_id)
+                return entry[1]
+
+        entry = self.backend.get(self.key(article_id))
+
+        if entry is None or entry[0] != fingerprint:
+            return None
+
+        self._remember(article_id, entry)
+
+        return entry[1]
+
+    def set(self, article_id: int, fingerprint: str, rendered: str) -> None:
+        entry = (fingerprint, rendered)
+
+        self.backend.set(self.key(article_id), entry, timeout=None)
+        self._remember(article_id, entry)
+
+    def invalidate(self, article_id: int) -> None:
+        """Drop the rendered HTML for one article."""
+
+        with self._lock:
+            self._local.pop(article_id, None)
+
+        self.backend.delete(self.key(article_id))
+
+    def invalidate_uploads(self) -> None:
+        """Invalidate every render that may contain a `$ident` link."""
+
+        self.backend.set(self.UPLOADS_GENERATION_KEY, time.time_ns(), timeout=None)
+
+        with self._lock:
+            self._local.clear()
+
+        upload_path_cache.clear()
+
+    def _remember(self, article_id: int, entry: tuple[str, str]) -> None:
+        with self._lock:
+            self._local[article_id] = entry
+            self._local.move_to_end(article_id)
+
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+
+class UploadPathCache:
+    """
+    Upload ident to path mapping shared by every render in this process.
+
+    Entries are tagged with the upload generation of :py:class:`RenderCache`,
+    so changes made by other processes are picked up too.
+    """
+
+    def __init__(self):
+        self._paths: dict[str, str] = {}
+        self._generation: int | None = None
+        self._lock = threading.Lock()
+
+    def get_many(self, idents: set[str], generation: int) -> dict[str, str]:
+        with self._lock:
+            if generation != self._generation:
+                return {}
+
+            return {
+                ident: self._paths[ident] for ident in idents if ident in self._paths
+            }
+
+    def set_many(self, paths: dict[str, str], generation: int) -> None:
+        with self._lock:
+            if generation != self._generation:
+                self._paths = {}
+                self._generation = generation
+
+            self._paths.update(paths)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._paths = {}
+            self._generation = None
+
+
+JSON_SCRIPT_ESCAPES = {ord("<"): "\\u003C", ord(">"): "\\u003E", ord("&"): "\\u0026"}
+
+
+def dump_json_ld(data: Any) -> str:
+    """
+    JSON for a `<script type="application/ld+json">`, escaped so article
+    titles can't close the script. Only pretty-printed in development.
+    """
+
+    return json.dumps(
+        data,
+        indent="\t" if settings.DEBUG else None,
+        separators=None if settings.DEBUG else (",", ":"),
+    ).translate(JSON_SCRIPT_ESCAPES)
+
+
+class SeoCache:
+    """
+    Serialized `Article.get_seo` payloads, keyed on article id and host (the
+    payload contains absolute URLs).
+
+    Every host has its own entry, so a flood of made-up `Host` headers only
+    adds entries for the cache to cull. They are dropped together by bumping
+    the version of the article when the article, its tags or its author change,
+    and also carry `modified` so an entry written during a save isn't served.
+    """
+
+    def __init__(self, alias: str = "render"):
+        self.alias = alias
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def key(article_id: int, host: str) -> str:
+        return f"seo:{article_id}:{host}"
+
+    @staticmethod
+    def version_key(article_id: int) -> str:
+        return f"seo-version:{article_id}"
+
+    def get_many(self, articles: Sequence, request: HttpRequest) -> list[str]:
+        """The JSON-LD of every article, rendering and caching what's missing."""
+
+        host = request.get_host()
+        entries = self.backend.get_many(
+            [self.version_key(article.pk) for article in articles]
+            + [self.key(article.pk, host) for article in articles]
+        )
+        updated = {}
+        payloads = []
+
+        for article in articles:
+            key = self.key(article.pk, host)
+            modified = article.modified.isoformat()
+            entry = entries.get(key)
+            # Timestamps, like the upload generation of `RenderCache`.
+            version = entries.get(self.version_key(article.pk))
+
+            if version is None:
+                version = self.backend.get_or_set(
+                    self.version_key(article.pk), time.time_ns, timeout=None
+                )
+
+            if (
+                entry is None
+                or entry["version"] != version
+                or entry["modified"] != modified
+            ):
+                entry = {
+                    "version": version,
+                    "modified": modified,
+                    "payload": dump_json_ld(article.get_seo(request)),
+                }
+                updated[key] = entry
+
+            payloads.append(entry["payload"])
+
+        if updated:
+            self.backend.set_many(updated, timeout=None)
+
+        return payloads
+
+    def get(self, article, request: HttpRequest) -> str:
+        return self.get_many([article], request)[0]
+
+    def invalidate(self, *article_ids: int) -> None:
+        version = time.time_ns()
+
+        self.backend.set_many(
+            {self.version_key(article_id): version for article_id in article_ids},
+            timeout=None,
+        )
+
+
+def with_json_ld_context(payload: str) -> str:
+    """Adds the schema.org `@context` to a serialized JSON-LD object."""
+
+    context = '"@context":"https://schema.org"'
+
+    return f"{{{context}}}" if payload == "{}" else f"{{{context},{payload[1:]}"
+
+
+render_cache = RenderCache()
+upload_path_cache = UploadPathCache()
+seo_cache = SeoCache()
@@ -0,0 +1,205 @@
+"""
+What rendered pages depend on.
+
+Pages record dependency keys while they are rendered, through
+:py:meth:`blog.pagecache.PageCache.add_tags`. When a model instance changes,
+:py:func:`changed_dependencies` gives the keys it affects. The page cache bumps
+the versions of those keys, and :py:class:`DependencyGraph` maps them back to
+the pages (e.g. exported files) that have to be rebuilt.
+
+- `article:<id>`: the article itself, its approved comments and the tags attached to it
+- `summary:<id>`: what the sitemap and feed show of an article (its URL, title,
+  description and date)
+- `upload:<ident>`: an upload linked to from the content with `$ident`
+- `tag:<id>`: a tag shown on the page (tags can be renamed)
+- `author:<id>`: the author shown on the page
+- `articles`: which articles are listed, and in which order (article list,
+  sitemap and feed)
+- `routes`: which article is served at a custom path
+"""
+
+from collections import defaultdict
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from taggit.models import Tag
+
+from .models import Article, Comment, Upload
+
+LIST_DEPENDENCY = "articles"
+ROUTES_DEPENDENCY = "routes"
+
+LISTING_FIELDS = ("is_hidden", "is_indexed", "page_url", "created")
+"""Fields of articles that decide whether and where they are listed."""
+
+SUMMARY_FIELDS = ("title", "description", "slug", "page_url", "created")
+"""Fields of articles that the sitemap and feed show."""
+
+STATE_FIELDS = tuple(dict.fromkeys(LISTING_FIELDS + SUMMARY_FIELDS))
+
+
+def article_dependency(article_id: int) -> str:
+    return f"article:{article_id}"
+
+
+def upload_dependency(ident: str) -> str:
+    return f"upload:{ident}"
+
+
+def tag_dependency(tag_id: int) -> str:
+    return f"tag:{tag_id}"
+
+
+def author_dependency(user_id: int) -> str:
+    return f"author:{user_id}"
+
+
+def summary_dependency(article_id: int) -> str:
+    return f"summary:{article_id}"
+
+
+def article_state(article: Article) -> dict[str, Any]:
+    """The fields of `article` that listings depend on, see `changed_dependencies`."""
+
+    return {field: getattr(article, field) for field in STATE_FIELDS}
+
+
+def is_in_listings(state: Mapping[str, Any] | None) -> bool:
+    # The feed shows every article that isn't hidden, the sitemap indexed ones.
+    return state is not None and (not state["is_hidden"] or state["is_indexed"])
+
+
+def changed_article_dependencies(article: Article, deleted: bool = False) -> set[str]:
+    """
+    The dependencies affected by saving or deleting `article`.
+
+    Compares the article with `article.previous_state` (its `article_state`
+    before saving, or None for new articles, set by the `pre_save` signal), so
+    that listings are only invalidated when what they show changed.
+    """
+
+    dependencies = {article_dependency(article.pk)}
+
+    if deleted:
+        before, after = article_state(article), None
+
+    elif hasattr(article, "previous_state"):
+        before, after = article.previous_state, article_state(article)
+
+    else:
+        # Nothing to compare with, so assume everything changed.
+        return dependencies | {
+            LIST_DEPENDENCY,
+            ROUTES_DEPENDENCY,
+            summary_dependency(article.pk),
+        }
+
+    def changed(fields: Iterable[str]) -> bool:
+        return (
+            before is None
+            or after is None
+            or any(before[field] != after[field] for field in fields)
+        )
+
+    if (is_in_listings(before) or is_in_listings(after)) and changed(LISTING_FIELDS):
+        dependencies.add(LIST_DEPENDENCY)
+
+    if changed(SUMMARY_FIELDS):
+        dependencies.add(summary_dependency(article.pk))
+
+    # Another article may have taken over a custom path, or it was given up.
+    page_urls = {state["page_url"] for state in (before, after) if state is not None}
+
+    if any(page_urls) and changed(["page_url"]):
+        dependencies.add(ROUTES_DEPENDENCY)
+
+    return dependencies
+
+
+def article_dependencies(
+    article: Article, idents: Iterable[str] = (), tag_ids: Iterable[int] = ()
+) -> set[str]:
+    """Dependencies of a page showing `article`, linking to `idents` and showing `tag_ids`."""
+
+    return {
+        article_dependency(article.pk),
+        author_dependency(article.author_id),
+        *map(upload_dependency, idents),
+        *map(tag_dependency, tag_ids),
+    }
+
+
+def changed_dependencies(instance: object, deleted: bool = False) -> set[str]:
+    """The dependencies affected by a change to (or deletion of) `instance`."""
+
+    match instance:
+        case Article():
+            return changed_article_dependencies(instance, deleted)
+
+        case Comment():
+            return {article_dependency(instance.article_id)}
+
+        case Upload():
+            # `previous_ident` is set by the `pre_save` signal.
+            idents = {instance.ident, getattr(instance, "previous_ident", None)}
+
+            return {upload_dependency(ident) for ident in idents if ident is not None}
+
+        case Tag():
+            return {tag_dependency(instance.pk)}
+
+        case _ if isinstance(instance, get_user_model()):
+            return {author_dependency(instance.pk)}
+
+    return set()
+
+
+class DependencyGraph:
+    """
+    Pages and the versions of the dependencies they were rendered from.
+
+    Versions are the tag versions of :py:class:`blog.pagecache.PageCache`.
+    """
+
+    def __init__(self, pages: Mapping[str, Mapping[str, int]] | None = None):
+        self.pages: dict[str, dict[str, int]] = {}
+        self.dependents: defaultdict[str, set[str]] = defaultdict(set)
+
+        for page, dependencies in (pages or {}).items():
+            self.record(page, dependencies)
+
+    def record(self, page: str, dependencies: Mapping[str, int]) -> None:
+        self.forget(page)
+
+        self.pages[page] = dict(dependencies)
+
+        for dependency in dependencies:
+            self.dependents[dependency].add(page)
+
+    def forget(self, page: str) -> None:
+        for dependency in self.pages.pop(page, {}):
+            self.dependents[dependency].discard(page)
+
+    def pages_for(self, instance: object, deleted: bool = False) -> set[str]:
+        """The pages to rebuild after `instance` changed (or was deleted)."""
+
+        return {
+            page
+            for dependency in changed_dependencies(instance, deleted)
+            for page in self.dependents.get(dependency, ())
+        }
+
+    def is_stale(self, page: str, versions: Mapping[str, int]) -> bool:
+        """
+        Whether `page` has to be rebuilt, given the current `versions` of its
+        dependencies. Pages that were never recorded are always stale.
+        """
+
+        if not (recorded := self.pages.get(page)):
+            return True
+
+        return any(
+            versions.get(dependency) != version
+            for dependency, version in recorded.items()
+        )
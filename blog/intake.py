@@ -0,0 +1,194 @@
+"""
+Write-behind queue for submitted comments.
+
+Submitting a comment only appends it to a small SQLite database of its own, so
+readers of the main database never wait on the write lock for a comment burst.
+A background thread of each process moves queued comments into the main
+database in batches, and `manage.py drain_comments` does the same (e.g. for
+comments left behind by a process that was stopped).
+
+A queued comment is only removed once the transaction adding it committed, so
+a process stopped mid-batch leaves its claim behind, and the batch is claimed
+again once the claim is older than `settings.COMMENT_INTAKE_CLAIM_TIMEOUT`.
+"""
+
+from collections.abc import Iterator
+from contextlib import closing, contextmanager
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Article, Comment, refresh_comment_counts
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS intake (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    article_id INTEGER NOT NULL,
+    comment TEXT NOT NULL,
+    -- When a process started adding the comment, or NULL.
+    claimed_at REAL
+)
+"""
+
+
+class CommentIntake:
+    """
+    Comments waiting to be added to the main database.
+
+    Rows are claimed with `UPDATE ... RETURNING`, so a comment is only moved by
+    one process, deleted once they were added, and released if adding them fails.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._worker: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        with closing(
+            sqlite3.connect(settings.COMMENT_INTAKE_PATH, timeout=30)
+        ) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+
+            with connection:
+                yield connection
+
+    def submit(self, comment: Comment) -> None:
+        """Queues a new comment, to be saved soon."""
+
+        fields = {
+            "name": comment.name,
+            "email": comment.email,
+            "content": comment.content,
+        }
+
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO intake (article_id, comment) VALUES (?, ?)",
+                (comment.article_id, json.dumps(fields)),
+            )
+
+        if settings.COMMENT_INTAKE_WORKER:
+            self.wake()
+
+    def pending(self) -> int:
+        with self.connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM intake").fetchone()[0]
+
+    def claim(
+        self, limit: int, timeout: float | None = None
+    ) -> list[tuple[int, int, str]]:
+        """Claims the oldest comments that aren't claimed, or whose claim is stale."""
+
+        now = time.time()
+        timeout = settings.COMMENT_INTAKE_CLAIM_TIMEOUT if timeout is None else timeout
+
+        with self.connect() as connection:
+            rows = connection.execute(
+                "UPDATE intake SET claimed_at = ? WHERE id IN "
+                "(SELECT id FROM intake WHERE claimed_at IS NULL OR claimed_at < ? "
+                "ORDER BY id LIMIT ?) "
+                "RETURNING id, article_id, comment",
+                (now, now - timeout, limit),
+            ).fetchall()
+
+        return sorted(rows)
+
+    def remove(self, ids: list[int]) -> None:
+        with self.connect() as connection:
+            connection.executemany(
+                "DELETE FROM intake WHERE id = ?", [(pk,) for pk in ids]
+            )
+
+    def release(self, ids: list[int]) -> None:
+        with self.connect() as connection:
+            connection.executemany(
+                "UPDATE intake SET claimed_at = NULL WHERE id = ?",
+                [(pk,) for pk in ids],
+            )
+
+    def drain(
+        self, batch_size: int | None = None, claim_timeout: float | None = None
+    ) -> int:
+        """Moves every queued comment into the main database, returning how many."""
+
+        batch_size = batch_size or settings.COMMENT_INTAKE_BATCH_SIZE
+        drained = 0
+
+        while rows := self.claim(batch_size, claim_timeout):
+            ids = [pk for pk, _, _ in rows]
+
+            try:
+                with transaction.atomic():
+                    self.add_comments([row[1:] for row in rows])
+
+            except Exception:
+                self.release(ids)
+                raise
+
+            # A process stopped right here adds the batch twice, rather than never.
+            self.remove(ids)
+            drained += len(rows)
+
+        return drained
+
+    @staticmethod
+    def add_comments(rows: list[tuple[int, str]]) -> None:
+        # Comments on articles deleted in the meantime are dropped.
+        articles = set(
+            Article.objects.filter(
+                pk__in={article_id for article_id, _ in rows}
+            ).values_list("pk", flat=True)
+        )
+        comments = [
+            Comment(article_id=article_id, **json.loads(fields))
+            for article_id, fields in rows
+            if article_id in articles
+        ]
+
+        # `bulk_create` skips `save` and the signals, so do their work here. New
+        # comments wait for approval, so only the comment counts change.
+        for comment in comments:
+            comment.email_hash = comment.get_email_hash()
+
+        Comment.objects.bulk_create(comments)
+        refresh_comment_counts(*articles)
+
+    def wake(self) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self.work, name="comment-intake", daemon=True
+                )
+                self._worker.start()
+
+        self._wake.set()
+
+    def work(self) -> None:
+        while True:
+            self._wake.wait()
+            # Let a burst of comments pile up so they're added in one transaction.
+            time.sleep(settings.COMMENT_INTAKE_DELAY)
+            self._wake.clear()
+
+            try:
+                self.drain()
+
+            except Exception:  # pylint: disable=broad-exception-caught
+                # The comments were released for the next try.
+                logger.exception("Couldn't save queued comments")
+
+            finally:
+                close_old_connections()
+
+
+comment_intake = CommentIntake()
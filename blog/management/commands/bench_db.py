@@ -0,0 +1,219 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.test.utils import override_settings
+
+from blog.models import Article, Comment
+from blog.views import COMMENTS_PER_PAGE
+from kazani.models import User
+
+
+def read_articles(alias: str, article_ids: list[int], deadline: float) -> int:
+    """Loads articles and their first page of comments like `get_article` does."""
+
+    rng = random.Random()
+    reads = 0
+
+    try:
+        while time.monotonic() < deadline:
+            article = (
+                Article.objects.using(alias)
+                .select_related("author")
+                .get(pk=rng.choice(article_ids))
+            )
+            list(
+                article.comments.filter(active=True)
+                .order_by("-created", "-id")
+                .values("id", "name", "created", "content", "email_hash")[
+                    :COMMENTS_PER_PAGE
+                ]
+            )
+            reads += 1
+
+    finally:
+        connections[alias].close()
+
+    return reads
+
+
+def write_comments(
+    alias: str, article_ids: list[int], deadline: float, rate: float
+) -> tuple[int, int]:
+    """
+    Adds `rate` comments per second, one transaction at a time, returning how
+    many and how many failed.
+
+    The rate is fixed so both profiles do the same writes, and the readers of
+    both compete for the same amount of CPU time.
+    """
+
+    rng = random.Random()
+    writes = 0
+    failed = 0
+    start = time.monotonic()
+
+    try:
+        while (now := time.monotonic()) < deadline:
+            # Catches up on writes that were held up by a lock.
+            if (ahead := start + (writes + failed) / rate - now) > 0:
+                time.sleep(ahead)
+                continue
+
+            comment = Comment(
+                article_id=rng.choice(article_ids),
+                name="Benchmark",
+                email="bench@example.com",
+                content="Comment " * 20,
+            )
+            comment.email_hash = comment.get_email_hash()
+
+            try:
+                # Skips the signals, which would go to the default database.
+                Comment.objects.using(alias).bulk_create([comment])
+                writes += 1
+
+            except OperationalError:
+                failed += 1
+
+    finally:
+        connections[alias].close()
+
+    return writes, failed
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks reading articles while comments are being written, on scratch "
+        "databases with SQLite's defaults and with `SQLITE_PRAGMAS`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--articles", type=int, default=50)
+        parser.add_argument(
+            "--comments", type=int, default=100, help="Comments per article."
+        )
+        parser.add_argument(
+            "--writes", type=float, default=50.0, help="Comments written per second."
+        )
+        parser.add_argument("--rounds", type=int, default=3)
+
+    def handle(self, *args, **options):
+        profiles = (
+            ("defaults", {}, {}),
+            (
+                "tuned",
+                settings.SQLITE_PRAGMAS,
+                settings.DATABASES["default"].get("OPTIONS", {}),
+            ),
+        )
+        benches: dict[str, tuple[str, dict, list[int]]] = {}
+
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                for name, pragmas, database_options in profiles:
+                    alias = f"bench-{name}"
+                    # Fills in the defaults of the other database settings.
+                    connections.settings[alias] = connections.configure_settings(
+                        {
+                            "default": {
+                                "ENGINE": "django.db.backends.sqlite3",
+                                "NAME": Path(directory) / f"{name}.sqlite3",
+                                "OPTIONS": database_options,
+                            }
+                        }
+                    )["default"]
+
+                    with override_settings(SQLITE_PRAGMAS=pragmas):
+                        call_command("migrate", database=alias, verbosity=0)
+                        article_ids = self.populate(
+                            alias, options["articles"], options["comments"]
+                        )
+
+                    connections[alias].close()
+                    benches[name] = (alias, pragmas, article_ids)
+
+                results = defaultdict(list)
+
+                # The profiles take turns, so neither gets a warmer machine.
+                for _ in range(options["rounds"]):
+                    for name, (alias, pragmas, article_ids) in benches.items():
+                        with override_settings(SQLITE_PRAGMAS=pragmas):
+                            results[name].append(
+                                self.bench(alias, article_ids, options)
+                            )
+
+            finally:
+                for alias, _, _ in benches.values():
+                    connections[alias].close()
+                    del connections.settings[alias]
+
+        seconds = options["seconds"]
+
+        for name, runs in results.items():
+            reads, writes, failed = (statistics.median(run) for run in zip(*runs))
+
+            self.stdout.write(
+                f"{name:>8}: {reads / seconds:8.1f} reads/s, "
+                f"{writes / seconds:8.1f} writes/s ({failed:.0f} failed), "
+                f"median of {len(runs)}"
+            )
+
+    @staticmethod
+    def bench(alias: str, article_ids: list[int], options) -> tuple[int, int, int]:
+        deadline = time.monotonic() + options["seconds"]
+
+        with ThreadPoolExecutor(options["readers"] + 1) as executor:
+            writer = executor.submit(
+                write_comments, alias, article_ids, deadline, options["writes"]
+            )
+            readers = [
+                executor.submit(read_articles, alias, article_ids, deadline)
+                for _ in range(options["readers"])
+            ]
+
+            reads = sum(reader.result() for reader in readers)
+            writes, failed = writer.result()
+
+        return reads, writes, failed
+
+    @staticmethod
+    def populate(alias: str, articles: int, comments: int) -> list[int]:
+        # `bulk_create` skips the signals, which would go to the default database.
+        (author,) = User.objects.using(alias).bulk_create([User(username="Benchmark")])
+        created = Article.objects.using(alias).bulk_create(
+            Article(
+                title=f"Article {i}",
+                slug=f"article-{i}",
+                content="Content. " * 500,
+                author=author,
+                is_hidden=False,
+            )
+            for i in range(articles)
+        )
+        article_ids = [article.pk for article in created]
+
+        Comment.objects.using(alias).bulk_create(
+            Comment(
+                article_id=article_id,
+                name=f"Commenter {i}",
+                email="bench@example.com",
+                email_hash="",
+                content="Comment " * 20,
+                active=True,
+            )
+            for article_id in article_ids
+            for i in range(comments)
+        )
+
+        return article_ids
@@ -0,0 +1,98 @@
+import html
+import random
+import timeit
+
+import emoji
+from django.core.management.base import BaseCommand
+
+from blog.render import HTMLRenderer, emoji_by_name
+
+
+def legacy_flatten_text(text: str) -> str:
+    """The old `emojize` + `analyze` + slicing implementation, for comparison."""
+
+    text = emoji.emojize(html.escape(text))
+    offset = 0
+
+    for emoji_ in emoji.analyze(text):
+        if isinstance(emoji_.value, str):
+            continue
+
+        tag = HTMLRenderer.get_emoji_tag(emoji_.chars)
+
+        text = (
+            text[: emoji_.value.start + offset]
+            + tag
+            + text[emoji_.value.end + offset :]
+        )
+
+        offset += len(tag) + emoji_.value.start - emoji_.value.end
+
+    return text
+
+
+def make_corpus(paragraphs: int, words: int, density: float) -> list[str]:
+    """Long paragraphs of words mixed with shortcodes, unicode emoji and HTML characters."""
+
+    rng = random.Random(0)
+    names = list(emoji_by_name().items())
+    vocabulary = "lorem ipsum dolor sit amet <b> & 'quoted' \"text\" 12:30".split()
+    corpus = []
+
+    for _ in range(paragraphs):
+        tokens = []
+
+        for _ in range(words):
+            if rng.random() >= density:
+                tokens.append(rng.choice(vocabulary))
+
+            elif rng.random() < 0.5:
+                tokens.append(f":{rng.choice(names)[0]}:")
+
+            else:
+                tokens.append(rng.choice(names)[1])
+
+        corpus.append(" ".join(tokens))
+
+    return corpus
+
+
+class Command(BaseCommand):
+    help = "Benchmarks escaping and emoji substitution of text nodes against the old implementation."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--paragraphs", type=int, default=50)
+        parser.add_argument("--words", type=int, default=400)
+        parser.add_argument(
+            "--density",
+            type=float,
+            default=0.1,
+            help="Fraction of words that are emoji.",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        corpus = make_corpus(
+            options["paragraphs"], options["words"], options["density"]
+        )
+        renderer = HTMLRenderer([])
+
+        # Build the lazy indexes outside of the timed runs.
+        renderer.flatten_text(":grinning_face: 😀")
+
+        for name, flatten in (
+            ("legacy", legacy_flatten_text),
+            ("single-pass", renderer.flatten_text),
+        ):
+            best = min(
+                timeit.repeat(
+                    lambda: [flatten(paragraph) for paragraph in corpus],
+                    number=1,
+                    repeat=options["repeat"],
+                )
+            )
+
+            self.stdout.write(
+                f"{name:>12}: {best * 1000:8.2f}ms for {len(corpus)} paragraphs "
+                f"({best / len(corpus) * 1e6:.1f}µs each)"
+            )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Article
+from blog.render import compile_article, has_current_ir
+
+
+class Command(BaseCommand):
+    help = (
+        "Compiles the stored IR of articles that are missing it, have an outdated "
+        "version or were changed without saving (e.g. with `update()`)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all", action="store_true", help="Recompile every article."
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        articles = Article.objects.order_by("pk")
+        compiled = []
+        total = 0
+        failed = 0
+
+        for article in articles.iterator(chunk_size=options["batch_size"]):
+            # The content hash can't be checked in SQL.
+            if not options["all"] and has_current_ir(article):
+                continue
+
+            compile_article(article)
+            compiled.append(article)
+            total += 1
+
+            if article.ir is None:
+                failed += 1
+                self.stderr.write(f"Could not parse article {article.pk}: {article}")
+
+            if len(compiled) >= options["batch_size"]:
+                Article.objects.bulk_update(compiled, ["ir", "ir_version", "ir_hash"])
+                compiled.clear()
+
+        Article.objects.bulk_update(compiled, ["ir", "ir_version", "ir_hash"])
+
+        self.stdout.write(f"Compiled {total} articles ({failed} failed).")
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Upload
+
+
+class Command(BaseCommand):
+    help = "Detects the MIME type, size and hash of uploads that are missing them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all", action="store_true", help="Detect them for every upload."
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        uploads = Upload.objects.order_by("pk")
+
+        if not options["all"]:
+            uploads = uploads.filter(content_hash="")
+
+        detected = []
+        total = 0
+        failed = 0
+
+        for upload in uploads.iterator(chunk_size=options["batch_size"]):
+            try:
+                upload.detect_metadata()
+
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f"Could not read upload {upload.pk}: {error}")
+                continue
+
+            detected.append(upload)
+            total += 1
+
+            if len(detected) >= options["batch_size"]:
+                Upload.objects.bulk_update(
+                    detected, ["mime_type", "size", "content_hash"]
+                )
+                detected.clear()
+
+        Upload.objects.bulk_update(detected, ["mime_type", "size", "content_hash"])
+
+        self.stdout.write(f"Detected {total} uploads ({failed} failed).")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from blog.intake import comment_intake
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds the comments waiting in the intake queue to the database, e.g. "
+        "those left behind by a server that was stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--claim-timeout",
+            type=float,
+            default=None,
+            help=(
+                "Seconds after which comments claimed by another process are "
+                "claimed again, e.g. 0 when no server is running. Defaults to "
+                "`COMMENT_INTAKE_CLAIM_TIMEOUT`."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        drained = comment_intake.drain(options["batch_size"], options["claim_timeout"])
+
+        self.stdout.write(f"Added {drained} comments.")
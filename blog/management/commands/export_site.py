@@ -0,0 +1,226 @@
+from collections.abc import AsyncIterator
+import json
+import os
+from pathlib import Path, PurePosixPath
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from blog.cache import RENDERER_VERSION
+from blog.dependencies import DependencyGraph
+from blog.models import Article
+from blog.pagecache import compress, minify, page_cache
+from blog.pagination import KeysetPaginator, listed_articles, listed_count
+from blog.views import ArticleListView
+
+MANIFEST = ".export.json"
+
+COMPRESSED_SUFFIXES = {"zstd": ".zst", "br": ".br", "gzip": ".gz"}
+
+
+def export_path(url: str, content_type: str) -> PurePosixPath:
+    """
+    Where the page at `url` is written, relative to the export root.
+
+    Pages of the article list (`/articles/?page=2`) go to `articles/page/2/`,
+    or `articles/after/<cursor>/` with keyset pagination.
+    """
+
+    parts = urlsplit(url)
+    path = PurePosixPath(parts.path.strip("/"))
+    query = parse_qs(parts.query)
+
+    if page := query.get("page"):
+        path = path / "page" / page[0]
+
+    elif cursor := query.get("after"):
+        path = path / "after" / cursor[0]
+
+    if path.suffix:
+        return path
+
+    return path / ("index.xml" if "xml" in content_type else "index.html")
+
+
+async def collect(chunks: AsyncIterator[bytes]) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports every public page (articles, custom paths, article lists, sitemap "
+        "and feed) as static files with pre-compressed siblings. Pages whose "
+        "dependencies haven't changed since the last export are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "host", help="Domain the site is served from, e.g. kazani.dev."
+        )
+        parser.add_argument("--output", type=Path, default=settings.EXPORT_ROOT)
+        parser.add_argument("--all", action="store_true", help="Re-export every page.")
+
+    def handle(self, *args, **options):
+        self.output: Path = options["output"].resolve()
+        self.output.mkdir(parents=True, exist_ok=True)
+        self.client = Client(HTTP_HOST=options["host"])
+
+        manifest_path = self.output / MANIFEST
+        manifest = {"renderer": RENDERER_VERSION, "pages": {}, "files": {}}
+
+        if manifest_path.exists() and not options["all"]:
+            previous = json.loads(manifest_path.read_text())
+
+            if previous.get("renderer") == RENDERER_VERSION:
+                manifest = previous
+
+        graph = DependencyGraph(manifest["pages"])
+        versions = page_cache.tag_versions(
+            {dependency for page in graph.pages.values() for dependency in page}
+        )
+
+        urls = self.get_urls()
+        files: dict[str, str] = {}
+        exported = 0
+
+        for url in urls:
+            if (
+                url in manifest["files"]
+                and (self.output / manifest["files"][url]).exists()
+                and not graph.is_stale(url, versions)
+            ):
+                files[url] = manifest["files"][url]
+                continue
+
+            path, dependencies = self.export(url)
+            graph.record(url, dependencies)
+            files[url] = str(path)
+            exported += 1
+
+        for url, stale in manifest["files"].items():
+            if url not in files:
+                graph.forget(url)
+                self.remove(stale)
+
+        manifest_path.write_text(
+            json.dumps(
+                {"renderer": RENDERER_VERSION, "pages": graph.pages, "files": files}
+            )
+        )
+
+        unchanged = len(urls) - exported
+
+        self.stdout.write(
+            f"Exported {exported} pages ({unchanged} unchanged) to {self.output}."
+        )
+
+    def get_urls(self) -> list[str]:
+        urls = []
+
+        urls.extend(
+            map(
+                self.article_url, Article.objects.filter(is_hidden=False).order_by("pk")
+            )
+        )
+        # Custom paths are public whether the article is listed or not (e.g.
+        # the homepage and `/about/` are usually hidden).
+        urls.extend(
+            Article.objects.filter(page_url__isnull=False)
+            .exclude(page_url="")
+            .order_by("pk")
+            .values_list("page_url", flat=True)
+        )
+
+        # The same articles `ArticleListView` shows to anonymous readers.
+        paginator = KeysetPaginator(
+            listed_articles(), ArticleListView.paginate_by, listed_count.get()
+        )
+
+        urls.append(reverse("articles"))
+
+        if settings.ARTICLE_LIST_PAGINATION == "keyset":
+            urls.extend(
+                f"{reverse('articles')}?after={cursor}"
+                for cursor in paginator.cursors()
+            )
+
+        else:
+            urls.extend(
+                f"{reverse('articles')}?page={page}"
+                for page in range(2, paginator.num_pages + 1)
+            )
+        urls.extend(["/sitemap.xml", "/feed/"])
+
+        return urls
+
+    @staticmethod
+    def article_url(article: Article) -> str:
+        return reverse(
+            "article",
+            kwargs={
+                "year": article.created.year,
+                "month": article.created.month,
+                "day": article.created.day,
+                "id": article.id,
+                "slug": article.slug,
+            },
+        )
+
+    def export(self, url: str) -> tuple[PurePosixPath, dict[str, int]]:
+        """Exports one page, returning where it went and what it depends on."""
+
+        response = self.client.get(url, secure=True)
+
+        if response.status_code != 200:
+            raise CommandError(f"{url} responded with {response.status_code}.")
+
+        if response.streaming:
+            # Streamed pages skip `MinifyHtmlMiddleware`.
+            body = minify(
+                (
+                    async_to_sync(collect)(response.streaming_content)
+                    if response.is_async
+                    else b"".join(response.streaming_content)
+                ),
+                response.charset,
+            )
+
+        else:
+            body = response.content
+
+        path = export_path(url, response["Content-Type"])
+        self.write(path, body)
+
+        return path, getattr(response, "page_cache_tags", {})
+
+    def remove(self, path: str) -> None:
+        for suffix in ("", *COMPRESSED_SUFFIXES.values()):
+            (self.output / f"{path}{suffix}").unlink(missing_ok=True)
+
+        # Remove directories left empty, e.g. of articles that were hidden.
+        for parent in (self.output / path).parents:
+            if parent == self.output or any(parent.iterdir()):
+                break
+
+            parent.rmdir()
+
+    def write(self, path: PurePosixPath, body: bytes) -> None:
+        target = (self.output / path).resolve()
+
+        if not target.is_relative_to(self.output):
+            raise CommandError(f"Refusing to write {path} outside of {self.output}.")
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        for encoding, content in compress(body, best=True).items():
+            destination = target.with_name(
+                target.name + COMPRESSED_SUFFIXES.get(encoding, "")
+            )
+            temporary = destination.with_name(f".{destination.name}.tmp")
+
+            temporary.write_bytes(content)
+            os.replace(temporary, destination)
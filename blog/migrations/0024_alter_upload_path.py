@@ -0,0 +1,22 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0023_upload_ident_alter_upload_path"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="upload",
+            name="path",
+            field=models.CharField(
+                blank=True,
+                help_text="Absolute path to serve file at (/media/image.png, etc.)",
+                max_length=512,
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0024_alter_upload_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="ir",
+            field=models.BinaryField(
+                help_text="Compressed IR compiled from the content when saved.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="ir_version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0025_article_ir"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="upload",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="SHA-256 of the file.",
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name="upload",
+            name="mime_type",
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="upload",
+            name="size",
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+    ]
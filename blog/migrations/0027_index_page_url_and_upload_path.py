@@ -0,0 +1,60 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+def dedupe_upload_paths(apps, schema_editor):
+    """Duplicate paths could never be served, so move all but the oldest aside."""
+
+    Upload = apps.get_model("blog", "Upload")
+    db_alias = schema_editor.connection.alias
+    seen = set()
+
+    for upload in Upload.objects.using(db_alias).order_by("pk"):
+        if upload.path in seen:
+            upload.path = f"{upload.path}-{upload.pk}"
+            upload.save(update_fields=["path"])
+
+        seen.add(upload.path)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0026_upload_metadata"),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_upload_paths, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="article",
+            name="page_url",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                default=None,
+                help_text="Absolute path to show page at (/ for homepage, /about, etc.)",
+                max_length=512,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="upload",
+            name="ident",
+            field=models.CharField(
+                db_index=True,
+                help_text="Identifier for the image. Used to auto-generate the url if it's not specified (/media/ident). Also used to refer to it in Markdown.",
+                max_length=512,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="upload",
+            name="path",
+            field=models.CharField(
+                blank=True,
+                help_text="Absolute path to serve file at (/media/image.png, etc.)",
+                max_length=512,
+                unique=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:10
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_comment_fields(apps, schema_editor):
+    Article = apps.get_model("blog", "Article")
+    Comment = apps.get_model("blog", "Comment")
+    db_alias = schema_editor.connection.alias
+
+    for comment in Comment.objects.using(db_alias):
+        comment.email_hash = hashlib.md5(comment.email.encode("utf-8")).hexdigest()
+        comment.save(update_fields=["email_hash"])
+
+    for article in Article.objects.using(db_alias).annotate(
+        active=Count("comments", filter=Q(comments__active=True)),
+        pending=Count("comments", filter=Q(comments__active=False)),
+    ):
+        article.active_comment_count = article.active
+        article.pending_comment_count = article.pending
+        article.save(update_fields=["active_comment_count", "pending_comment_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0028_article_created_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="active_comment_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="pending_comment_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="email_hash",
+            field=models.CharField(
+                default="",
+                editable=False,
+                help_text="MD5 of the email for Libravatar.",
+                max_length=32,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["article", "active", "created"],
+                name="comment_article_active_idx",
+            ),
+        ),
+        migrations.RunPython(fill_comment_fields, migrations.RunPython.noop),
+    ]
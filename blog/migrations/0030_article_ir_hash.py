@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0029_comment_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="ir_hash",
+            field=models.CharField(default="", editable=False, max_length=64),
+        ),
+    ]
@@ -1,5 +1,10 @@
+import hashlib
+import mimetypes
+import subprocess
 from typing import Any
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.http import HttpRequest
 from django.urls import reverse
 from taggit.managers import TaggableManager
@@ -26,6 +31,7 @@ class Article(models.Model):
         null=True,
         blank=True,
         default=None,
+        db_index=True,
         help_text="Absolute path to show page at (/ for homepage, /about, etc.)",
     )
     created = models.DateTimeField(auto_now_add=True)
@@ -69,6 +75,19 @@ class Article(models.Model):
     extra_seo = models.JSONField(default=dict, blank=True)
     override_seo = models.BooleanField(default=False)
 
+    ir = models.BinaryField(
+        null=True,
+        editable=False,
+        help_text="Compressed IR compiled from the content when saved.",
+    )
+    ir_version = models.PositiveIntegerField(default=0, editable=False)
+    # What the IR was compiled from, since `update()` and raw SQL skip `save()`.
+    ir_hash = models.CharField(max_length=64, default="", editable=False)
+
+    # Kept up to date by `refresh_comment_counts`.
+    active_comment_count = models.PositiveIntegerField(default=0, editable=False)
+    pending_comment_count = models.PositiveIntegerField(default=0, editable=False)
+
     __prev_is_hidden = None
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
@@ -93,6 +112,24 @@ class Article(models.Model):
         if self.page_url:
             self.page_url = self.page_url.rstrip("/") + "/"
 
+        update_fields = kwargs.get("update_fields")
+
+        if update_fields is None or {"content", "content_type"} & set(update_fields):
+            # blog.render imports this module.
+            from blog.render import (  # pylint: disable=import-outside-toplevel
+                compile_article,
+            )
+
+            compile_article(self)
+
+            if update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields,
+                    "ir",
+                    "ir_version",
+                    "ir_hash",
+                }
+
         super().save(*args, **kwargs)
         self.__prev_is_hidden = self.is_hidden
 
@@ -141,7 +178,8 @@ class Article(models.Model):
                 "dateCreated": self.created.isoformat(),
                 "datePublished": self.created.isoformat(),
                 "dateModified": self.modified.isoformat(),
-                "keywords": [tag[1] for tag in self.tags.values_list()],
+                # `all()` so prefetched tags are used, see `ArticleListView`.
+                "keywords": [tag.name for tag in self.tags.all()],
                 "url": f"https://{request.get_host()}{self.get_absolute_url()}",
                 "sameAs": same_as,
                 "author": {
@@ -160,6 +198,10 @@ class Article(models.Model):
 
     class Meta:
         ordering = ["created"]
+        indexes = [
+            # Keyset pagination of the article list, see `blog.pagination`.
+            models.Index(fields=["created", "id"], name="article_created_id_idx"),
+        ]
 
 
 class Comment(models.Model):
@@ -171,35 +213,150 @@ class Comment(models.Model):
     content = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
     active = models.BooleanField(default=False)
+    email_hash = models.CharField(
+        max_length=32,
+        default="",
+        editable=False,
+        help_text="MD5 of the email for Libravatar.",
+    )
 
     class Meta:
         ordering = ["-created"]
+        indexes = [
+            # The approved comments of an article, newest first.
+            models.Index(
+                fields=["article", "active", "created"],
+                name="comment_article_active_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.content!r} by {self.name}"
 
+    def get_email_hash(self) -> str:
+        return hashlib.md5(self.email.encode("utf-8")).hexdigest()
+
+    def save(self, *args, **kwargs) -> None:
+        self.email_hash = self.get_email_hash()
+
+        update_fields = kwargs.get("update_fields")
+
+        if update_fields is not None and "email" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "email_hash"}
+
+        super().save(*args, **kwargs)
+
+
+def refresh_comment_counts(*article_ids: int) -> None:
+    """Counts the approved and pending comments of articles again."""
+
+    def count(active: bool) -> Coalesce:
+        return Coalesce(
+            Subquery(
+                Comment.objects.filter(article=OuterRef("pk"), active=active)
+                .order_by()
+                .values("article")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        )
+
+    Article.objects.filter(pk__in=article_ids).update(
+        active_comment_count=count(True), pending_comment_count=count(False)
+    )
+
+
+def detect_mime_type(head: bytes, name: str) -> str:
+    """
+    Detects the MIME type of a file from its first bytes using `file`, falling
+    back to guessing from the name if `file` isn't installed.
+    """
+
+    try:
+        return (
+            subprocess.run(
+                ["file", "-ib", "-"], input=head, capture_output=True, check=True
+            )
+            .stdout.decode()
+            .strip()
+        )
+
+    except (OSError, subprocess.CalledProcessError):
+        return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
 
 class Upload(models.Model):
     ident = models.CharField(
         max_length=512,
+        db_index=True,
         help_text="Identifier for the image. Used to auto-generate the url if it's not specified (/media/ident). Also used to refer to it in Markdown.",
     )
     path = models.CharField(
         max_length=512,
         help_text="Absolute path to serve file at (/media/image.png, etc.)",
         blank=True,
+        unique=True,
     )
     content = models.FileField(upload_to="uploads/")
 
+    mime_type = models.CharField(max_length=255, blank=True, editable=False)
+    size = models.PositiveBigIntegerField(null=True, editable=False)
+    content_hash = models.CharField(
+        max_length=64, blank=True, editable=False, help_text="SHA-256 of the file."
+    )
+
+    MIME_SNIFF_SIZE = 64 * 1024
+
     def __str__(self) -> str:
         return self.content.name
 
-    def save(self, *args, **kwargs) -> None:
+    def detect_metadata(self) -> None:
+        """Detects the MIME type, size and hash of the file (without saving)."""
+
+        digest = hashlib.sha256()
+        head = b""
+        size = 0
+
+        self.content.open("rb")
+
+        for chunk in self.content.chunks():
+            if len(head) < self.MIME_SNIFF_SIZE:
+                head += chunk[: self.MIME_SNIFF_SIZE - len(head)]
+
+            digest.update(chunk)
+            size += len(chunk)
+
+        # Closing a new upload would discard it before it's stored.
+        if self.content._committed:  # pylint: disable=protected-access
+            self.content.close()
+
+        else:
+            self.content.seek(0)
+
+        self.mime_type = detect_mime_type(head, self.content.name)
+        self.size = size
+        self.content_hash = digest.hexdigest()
+
+    def normalize(self) -> None:
         if self.path is None or self.path.strip() == "":
             self.path = f"/media/{self.ident.strip()}"
 
         self.ident = self.ident.strip()
 
+    def clean(self) -> None:
+        # So that the default path is checked for uniqueness too.
+        self.normalize()
+
+    def save(self, *args, **kwargs) -> None:
+        self.normalize()
+
+        if (
+            not self.content._committed  # pylint: disable=protected-access
+            or not self.content_hash
+        ):
+            self.detect_metadata()
+
         super().save(*args, **kwargs)
 
     def get_absolute_url(self) -> str:
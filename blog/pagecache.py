@@ -0,0 +1,475 @@
+"""
+Full-page cache for anonymous readers.
+
+Pages are cached once per version, minified and pre-compressed with every
+encoding available (zstd, brotli, gzip), keyed on the host, path and the query
+parameters the views read (`QUERY_PARAMETERS`). Requests with any other query
+parameter (e.g. `?utm_source=`), for a host not in `settings.PAGE_CACHE_HOSTS`
+or with a malformed page number or cursor bypass the cache, so they can't fill
+it with copies of the same page. Readers get the best encoding their
+`Accept-Encoding` allows, without the page being minified or compressed again.
+
+Every page is tagged with what it was rendered from (see `blog.dependencies`),
+and each tag has a version in the cache. Changing a model gives its tags new
+versions, which turns every page rendered from the old versions into a miss.
+
+Requests with a session cookie (i.e. logged in users) always bypass the cache.
+"""
+
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+import gzip
+import time
+from typing import Any
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import InvalidPage
+from django.http import HttpRequest, HttpResponse
+from django.http.request import split_domain_port, validate_host
+from django.http.response import HttpResponseBase
+from django.middleware.csrf import get_token
+from django.middleware.gzip import GZipMiddleware
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import urlencode
+from django_minify_html.middleware import MinifyHtmlMiddleware
+import minify_html
+
+from .cache import RENDERER_VERSION
+from .pagination import decode_cursor, encode_cursor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CACHED_HEADERS = ("Content-Type", "Content-Language", "ETag", "Vary")
+QUERY_PARAMETERS = ("page", "after")
+
+
+def minify(body: bytes, charset: str = "utf-8") -> bytes:
+    """Minifies HTML the same way `MinifyHtmlMiddleware` does."""
+
+    return minify_html.minify(
+        body.decode(charset), **MinifyHtmlMiddleware.minify_args
+    ).encode(charset)
+
+
+def compress(body: bytes, best: bool = False) -> dict[str, bytes]:
+    """
+    `body` in every available encoding, most preferred first.
+
+    Pages are compressed on a cache miss, while the reader waits, so only
+    `manage.py export_site` asks for the `best` (and much slower) levels.
+    """
+
+    variants = {}
+
+    if zstandard is not None:
+        variants["zstd"] = zstandard.ZstdCompressor(level=19 if best else 3).compress(
+            body
+        )
+
+    if brotli is not None:
+        variants["br"] = brotli.compress(
+            body, mode=brotli.MODE_TEXT, quality=11 if best else 5
+        )
+
+    variants["gzip"] = gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+    variants["identity"] = body
+
+    return variants
+
+
+def negotiate_encoding(accept_encoding: str, available: Iterable[str]) -> str:
+    """The first of `available` allowed by an `Accept-Encoding` header."""
+
+    qualities: dict[str, float] = {}
+
+    for coding in accept_encoding.split(","):
+        name, *params = coding.split(";")
+        quality = 1.0
+
+        for param in params:
+            key, _, value = param.partition("=")
+
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+
+                except ValueError:
+                    quality = 0.0
+
+        qualities[name.strip().lower()] = quality
+
+    for encoding in available:
+        if encoding == "identity" or qualities.get(encoding, qualities.get("*", 0)) > 0:
+            return encoding
+
+    return "identity"
+
+
+def cache_anonymous(view: Callable) -> Callable:
+    """Marks a view as cacheable for anonymous readers."""
+
+    view.cache_anonymous = True  # type: ignore[attr-defined]
+
+    return view
+
+
+class PageCache:
+    def __init__(self, alias: str = "pages"):
+        self.alias = alias
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def canonical_host(request: HttpRequest) -> str | None:
+        """The host of `request` in lowercase, if pages are cached for it."""
+
+        domain, port = split_domain_port(request.get_host())
+
+        if not validate_host(domain, getattr(settings, "PAGE_CACHE_HOSTS", [])):
+            return None
+
+        return f"{domain}:{port}" if port else domain
+
+    @staticmethod
+    def canonical_query(request: HttpRequest) -> str | None:
+        """
+        The query parameters read by the views, in a single spelling (no
+        `?page=02` or `?page=1`), or None if one is malformed.
+        """
+
+        query = []
+
+        if (page := request.GET.get("page")) is not None:
+            if page != "last":
+                try:
+                    page = str(int(page))
+
+                except ValueError:
+                    return None
+
+            if page != "1":
+                query.append(("page", page))
+
+        if (cursor := request.GET.get("after")) is not None:
+            try:
+                query.append(("after", encode_cursor(*decode_cursor(cursor))))
+
+            except InvalidPage:
+                return None
+
+        return urlencode(query)
+
+    @classmethod
+    def key(cls, request: HttpRequest) -> str | None:
+        """The key of the page for `request`, or None if it isn't cached."""
+
+        host = cls.canonical_host(request)
+        query = cls.canonical_query(request)
+
+        if host is None or query is None:
+            return None
+
+        return f"page:{RENDERER_VERSION}:{host}{request.path}?{query}"
+
+    def tag_versions(self, tags: Iterable[str]) -> dict[str, int]:
+        """
+        The current version of every tag.
+
+        Versions are timestamps rather than counters starting at 0, so a tag
+        that was evicted from the cache gets a new version instead of going
+        back to one old pages were stored with.
+        """
+
+        keys = {f"tag:{tag}": tag for tag in tags}
+        versions = self.backend.get_many(keys)
+
+        if missing := {key: time.time_ns() for key in keys if key not in versions}:
+            self.backend.set_many(missing, timeout=None)
+            versions.update(missing)
+
+        return {tag: versions[key] for key, tag in keys.items()}
+
+    @staticmethod
+    def is_enabled(request: HttpRequest) -> bool:
+        """Whether the response to `request` may be cached."""
+
+        return hasattr(request, "page_cache_tags")
+
+    def add_tags(self, request: HttpRequest, *tags: str) -> None:
+        """
+        Records what the page for `request` is rendered from.
+
+        Call this before rendering: the current tag versions are taken now, so
+        a change made during rendering still invalidates the page. Only pages
+        with tags are cached.
+        """
+
+        if not self.is_enabled(request):
+            return
+
+        versions = request.page_cache_tags  # type: ignore[attr-defined]
+        versions.update(self.tag_versions(set(tags) - versions.keys()))
+
+    def invalidate(self, *tags: str) -> None:
+        self.backend.set_many(
+            {f"tag:{tag}": time.time_ns() for tag in tags}, timeout=None
+        )
+
+    def get(self, request: HttpRequest) -> HttpResponse | None:
+        if (key := self.key(request)) is None:
+            return None
+
+        entry = self.backend.get(key)
+
+        if entry is None or self.tag_versions(entry["tags"].keys()) != entry["tags"]:
+            return None
+
+        encoding = negotiate_encoding(
+            request.headers.get("Accept-Encoding", ""), entry["bodies"]
+        )
+        response = HttpResponse(entry["bodies"][encoding])
+        response.page_cache_tags = entry["tags"]  # type: ignore[attr-defined]
+
+        for header, value in entry["headers"].items():
+            response[header] = value
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+
+            # Like `GZipMiddleware`, compressed variants only match weakly.
+            if (etag := response.get("ETag", "")).startswith('"'):
+                response["ETag"] = f"W/{etag}"
+
+        return response
+
+    def set(
+        self,
+        key: str,
+        response: HttpResponseBase,
+        body: bytes,
+        tags: dict[str, int],
+    ) -> None:
+        """
+        Stores a page, minifying it (streamed pages skip `MinifyHtmlMiddleware`)
+        and compressing it with every available encoding.
+        """
+
+        if response.streaming and response["Content-Type"].startswith("text/html"):
+            body = minify(body, response.charset)
+
+        self.backend.set(
+            key,
+            {
+                "headers": response.page_cache_headers,  # type: ignore[attr-defined]
+                "bodies": compress(body),
+                "tags": tags,
+            },
+            timeout=None,
+        )
+
+
+page_cache = PageCache()
+
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/xml",
+    "application/atom+xml",
+)
+
+
+class TextGZipMiddleware(GZipMiddleware):
+    """
+    `GZipMiddleware` for pages only.
+
+    Uploads are left alone: compressing a byte range would change what the
+    range refers to, the weakened ETag would never match `If-Range` again, and
+    media files hardly compress anyway.
+    """
+
+    def process_response(
+        self, request: HttpRequest, response: HttpResponseBase
+    ) -> HttpResponseBase:
+        if (
+            response.has_header("Accept-Ranges")
+            or response.has_header("Content-Range")
+            or not response.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES)
+        ):
+            return response
+
+        return super().process_response(request, response)
+
+
+class PageCacheMiddleware:
+    """
+    Serves and stores pages of views marked with :py:func:`cache_anonymous`.
+
+    Goes after `CsrfViewMiddleware` (so cached pages still get a CSRF cookie)
+    and `TextGZipMiddleware` (which leaves pages that are already compressed
+    alone), but before `MinifyHtmlMiddleware`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable) -> None:
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> Any:
+        if self.async_mode:
+            return self.__acall__(request)
+
+        if not self.is_cacheable(request):
+            return self.get_response(request)
+
+        if (cached := page_cache.get(request)) is not None:
+            return self.hit(request, cached)
+
+        request.page_cache_tags = {}  # type: ignore[attr-defined]
+        key = page_cache.key(request)
+        response = self.get_response(request)
+        # What the page was rendered from, e.g. for `manage.py export_site`.
+        response.page_cache_tags = request.page_cache_tags  # type: ignore[attr-defined]
+
+        if key is None or not self.should_store(request, response):
+            return response
+
+        if response.streaming:
+            return self.store_streamed(request, key, response)
+
+        page_cache.set(key, response, response.content, request.page_cache_tags)  # type: ignore[attr-defined]
+
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        if not self.is_cacheable(request):
+            return await self.get_response(request)
+
+        if (cached := await sync_to_async(page_cache.get)(request)) is not None:
+            return self.hit(request, cached)
+
+        request.page_cache_tags = {}  # type: ignore[attr-defined]
+        key = page_cache.key(request)
+        response = await self.get_response(request)
+        # What the page was rendered from, e.g. for `manage.py export_site`.
+        response.page_cache_tags = request.page_cache_tags  # type: ignore[attr-defined]
+
+        if key is None or not self.should_store(request, response):
+            return response
+
+        if response.streaming:
+            return self.store_streamed(request, key, response)
+
+        await sync_to_async(page_cache.set)(
+            key, response, response.content, request.page_cache_tags  # type: ignore[attr-defined]
+        )
+
+        return response
+
+    @staticmethod
+    def is_cacheable(request: HttpRequest) -> bool:
+        if request.method not in ("GET", "HEAD"):
+            return False
+
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return False
+
+        if any(
+            parameter not in QUERY_PARAMETERS or len(request.GET.getlist(parameter)) > 1
+            for parameter in request.GET
+        ):
+            return False
+
+        try:
+            match = resolve(request.path_info)
+
+        except Resolver404:
+            return False
+
+        return getattr(match.func, "cache_anonymous", False)
+
+    @staticmethod
+    def hit(request: HttpRequest, response: HttpResponse) -> HttpResponseBase:
+        # The comment form fills its token in from the cookie, so make sure there is one.
+        get_token(request)
+
+        return get_conditional_response(request, etag=response.get("ETag")) or response
+
+    @staticmethod
+    def should_store(request: HttpRequest, response: HttpResponseBase) -> bool:
+        if not (
+            request.method == "GET"
+            and response.status_code == 200
+            and bool(getattr(request, "page_cache_tags", None))
+            and not response.cookies
+            and "private" not in response.get("Cache-Control", "")
+        ):
+            return False
+
+        # Outer middleware may still change these (`GZipMiddleware` weakens the
+        # ETag) before a streamed page is stored.
+        response.page_cache_headers = {  # type: ignore[attr-defined]
+            header: response[header]
+            for header in CACHED_HEADERS
+            if response.has_header(header)
+        }
+
+        return True
+
+    @staticmethod
+    def store_streamed(
+        request: HttpRequest, key: str, response: HttpResponseBase
+    ) -> HttpResponseBase:
+        """Caches a streamed page once the last chunk has been sent."""
+
+        tags = request.page_cache_tags  # type: ignore[attr-defined]
+        original = response.streaming_content  # type: ignore[attr-defined]
+
+        if response.is_async:  # type: ignore[attr-defined]
+
+            async def async_tee() -> AsyncIterator[bytes]:
+                chunks = []
+
+                async for chunk in original:
+                    chunks.append(chunk)
+                    yield chunk
+
+                await sync_to_async(page_cache.set)(
+                    key, response, b"".join(chunks), tags
+                )
+
+            response.streaming_content = async_tee()  # type: ignore[attr-defined]
+
+        else:
+
+            def tee() -> Iterator[bytes]:
+                chunks = []
+
+                for chunk in original:
+                    chunks.append(chunk)
+                    yield chunk
+
+                page_cache.set(key, response, b"".join(chunks), tags)
+
+            response.streaming_content = tee()  # type: ignore[attr-defined]
+
+        return response
@@ -0,0 +1,193 @@
+"""
+Keyset pagination for the article list (and the comments of articles).
+
+Offset pagination has the database count every listed article and skip over
+all of the articles on earlier pages. Keyset pages instead start after a cursor
+(the `created` and `id` of the last article of the previous page), which the
+`(created, id)` index finds directly, so deep pages cost the same as the first.
+The total is cached and only counted again when an article is published,
+hidden or deleted.
+"""
+
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta, timezone
+import math
+from typing import Any
+
+import base32_crockford
+from django.core.cache import caches
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.db.models import Q, QuerySet
+
+from .models import Article
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MAX_MICROSECONDS = (datetime.max.replace(tzinfo=timezone.utc) - EPOCH) // timedelta(
+    microseconds=1
+)
+# SQLite integers are signed 64-bit.
+MAX_PK = 2**63 - 1
+
+
+def listed_articles() -> QuerySet[Article]:
+    """The articles the article list shows to everyone but superusers."""
+
+    return Article.objects.filter(is_hidden=False).exclude(page_url="/")
+
+
+def is_listed(state: Mapping[str, Any] | None) -> bool:
+    """Whether :py:func:`listed_articles` has an article with this `article_state`."""
+
+    return state is not None and not state["is_hidden"] and state["page_url"] != "/"
+
+
+def encode_cursor(created: datetime, pk: int) -> str:
+    microseconds = (created - EPOCH) // timedelta(microseconds=1)
+
+    return f"{base32_crockford.encode(microseconds)}-{base32_crockford.encode(pk)}"
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        microseconds, pk = map(base32_crockford.decode, cursor.split("-"))
+
+        if microseconds > MAX_MICROSECONDS or pk > MAX_PK:
+            raise ValueError("Cursor out of range")
+
+        created = EPOCH + timedelta(microseconds=microseconds)
+
+    except (ValueError, OverflowError) as e:
+        raise PageNotAnInteger("That cursor is invalid") from e
+
+    return created, pk
+
+
+def after_cursor(cursor: str) -> Q:
+    """Filters rows ordered newest first on `(created, id)` to those after `cursor`."""
+
+    created, pk = decode_cursor(cursor)
+
+    return Q(created__lt=created) | Q(created=created, id__lt=pk)
+
+
+class ListedCount:
+    """The number of listed articles, kept in the shared `render` cache."""
+
+    KEY = "listed-articles"
+
+    def __init__(self, alias: str = "render"):
+        self.alias = alias
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def get(self) -> int:
+        return self.backend.get_or_set(
+            self.KEY, lambda: listed_articles().count(), timeout=None
+        )
+
+    def refresh(self) -> None:
+        self.backend.set(self.KEY, listed_articles().count(), timeout=None)
+
+
+class KeysetPage(Sequence):
+    """
+    A page of articles, mostly compatible with :py:class:`django.core.paginator.Page`.
+
+    `previous_cursor` is `None` when the previous page is the first one.
+    """
+
+    def __init__(
+        self,
+        object_list: list[Article],
+        paginator: "KeysetPaginator",
+        has_previous: bool,
+        previous_cursor: str | None,
+        next_cursor: str | None,
+    ):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def __getitem__(self, index: Any) -> Any:
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self._has_previous
+
+    def has_other_pages(self) -> bool:
+        return self.has_previous() or self.has_next()
+
+
+class KeysetPaginator:
+    """Pages of `queryset`, newest first, starting after a cursor."""
+
+    ordering = ("-created", "-id")
+
+    def __init__(self, queryset: QuerySet[Article], per_page: int, count: int):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.count = count
+
+    @property
+    def num_pages(self) -> int:
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def page(self, cursor: str | None = None) -> KeysetPage:
+        queryset = self.queryset.order_by(*self.ordering)
+
+        if cursor is None:
+            has_previous, previous_cursor = False, None
+
+        else:
+            created, pk = decode_cursor(cursor)
+            queryset = queryset.filter(after_cursor(cursor))
+
+            # The cursor is the last article of the previous page, and the
+            # article before that page is where it starts.
+            newer = list(
+                self.queryset.filter(
+                    Q(created__gt=created) | Q(created=created, id__gte=pk)
+                )
+                .order_by("created", "id")
+                .values_list("created", "id")[: self.per_page + 1]
+            )
+            has_previous = bool(newer)
+            previous_cursor = (
+                encode_cursor(*newer[-1]) if len(newer) > self.per_page else None
+            )
+
+        object_list = list(queryset[: self.per_page + 1])
+
+        if cursor is not None and not object_list:
+            raise EmptyPage("That page contains no results")
+
+        next_cursor = None
+
+        if len(object_list) > self.per_page:
+            object_list = object_list[: self.per_page]
+            next_cursor = encode_cursor(object_list[-1].created, object_list[-1].pk)
+
+        return KeysetPage(object_list, self, has_previous, previous_cursor, next_cursor)
+
+    def cursors(self) -> list[str]:
+        """The cursors of every page after the first."""
+
+        rows = list(self.queryset.order_by(*self.ordering).values_list("created", "id"))
+
+        return [
+            encode_cursor(*rows[end - 1])
+            for end in range(self.per_page, len(rows), self.per_page)
+        ]
+
+
+listed_count = ListedCount()
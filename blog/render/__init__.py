@@ -1,13 +1,17 @@
-from collections.abc import Sequence
+from collections.abc import Iterator, Mapping, Sequence
+import functools
+import hashlib
 import html
 import json
 import re
+import zlib
 from typing import Literal, NotRequired, TypedDict, cast
 import emoji
 import marko
 import marko.element
 import marko.inline
 
+from blog.cache import render_cache, upload_path_cache
 from blog.models import Article, Upload
 
 
@@ -157,17 +161,151 @@ Node = (
 IRType = Sequence[Node]
 
 
-def transform_url(url: str) -> str:
-    """Handle links to uploads."""
+@functools.cache
+def emoji_by_name() -> dict[str, str]:
+    """Maps English emoji names (without the colons) to the unicode emoji."""
 
-    if url.startswith("$"):
-        upload = Upload.objects.filter(ident=url[1:]).first()
+    index: dict[str, str] = {}
+
+    for unicode_emoji, names in emoji.EMOJI_DATA.items():
+        index.setdefault(names["en"].strip(":"), unicode_emoji)
+
+    return index
+
+
+@functools.cache
+def emoji_trie() -> dict[str, dict]:
+    """
+    A character trie of every unicode emoji.
+    Nodes that complete an emoji have the empty string as a key.
+    """
+
+    trie: dict[str, dict] = {}
+
+    for unicode_emoji in emoji.EMOJI_DATA:
+        node = trie
+
+        for char in unicode_emoji:
+            node = node.setdefault(char, {})
+
+        node[""] = {}
+
+    return trie
+
+
+HTML_ESCAPES = {
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&#x27;",
+}
+
+
+@functools.cache
+def text_token_pattern() -> re.Pattern[str]:
+    """
+    Matches everything :py:meth:`HTMLRenderer.flatten_text` has to replace:
+    shortcodes, characters that need escaping and the first character of an emoji.
+    """
+
+    starts = sorted({unicode_emoji[0] for unicode_emoji in emoji.EMOJI_DATA})
+    # Digits, `#` and `*` only start keycap emoji, so don't stop on every digit.
+    ascii_starts = "".join(re.escape(char) for char in starts if char.isascii())
 
-        if upload is not None:
-            return upload.path
+    # A class with every start character is scanned linearly by `re` for astral
+    # characters, so merge them into a few coarse ranges instead. False
+    # positives are rejected by the trie.
+    ranges: list[list[int]] = []
+
+    for char in starts:
+        if char.isascii():
+            continue
+
+        if ranges and ord(char) - ranges[-1][1] <= 256:
+            ranges[-1][1] = ord(char)
 
         else:
-            return ""
+            ranges.append([ord(char), ord(char)])
+
+    other_starts = "".join(
+        f"{re.escape(chr(first))}-{re.escape(chr(last))}" for first, last in ranges
+    )
+
+    return re.compile(
+        r":(?P<shortcode>[^\s:]+):"
+        + f"|(?P<escape>[{re.escape(''.join(HTML_ESCAPES))}])"
+        + f"|[{other_starts}]"
+        + f"|[{ascii_starts}](?=\ufe0f?\u20e3)"
+    )
+
+
+def collect_upload_idents(
+    node: Node | InlineNode, idents: set[str] | None = None
+) -> set[str]:
+    """Collects the idents of every `$ident` link and image in the tree."""
+
+    if idents is None:
+        idents = set()
+
+    if isinstance(node, str):
+        return idents
+
+    if isinstance(node, Sequence):
+        for child in node:
+            collect_upload_idents(child, idents)
+
+        return idents
+
+    if not isinstance(node, dict):
+        return idents
+
+    match node:
+        case {"type": "link", "url": str() as url} | {
+            "type": "image",
+            "source": str() as url,
+        } if url.startswith("$"):
+            idents.add(url[1:])
+
+    for value in node.values():
+        collect_upload_idents(value, idents)
+
+    return idents
+
+
+def resolve_upload_paths(idents: set[str]) -> dict[str, str]:
+    """
+    Maps upload idents to their paths, or the empty string for unknown idents.
+
+    Uses the shared ident cache and resolves the rest with a single query.
+    """
+
+    if not idents:
+        return {}
+
+    generation = render_cache.uploads_generation()
+    paths = upload_path_cache.get_many(idents, generation)
+
+    if missing := idents - paths.keys():
+        # Descending so that the oldest upload wins when idents collide.
+        found = dict(
+            Upload.objects.filter(ident__in=missing)
+            .order_by("-pk")
+            .values_list("ident", "path")
+        )
+        resolved = {ident: found.get(ident, "") for ident in missing}
+
+        upload_path_cache.set_many(resolved, generation)
+        paths.update(resolved)
+
+    return paths
+
+
+def transform_url(url: str, upload_paths: Mapping[str, str]) -> str:
+    """Handle links to uploads."""
+
+    if url.startswith("$"):
+        return upload_paths.get(url[1:], "")
 
     return url
 
@@ -178,102 +316,175 @@ class HTMLRenderer:
     def __init__(self, data: IRType):
         self.data = data
 
+    @functools.cached_property
+    def upload_paths(self) -> dict[str, str]:
+        """Paths of every upload referenced in :py:attr self.data:, resolved up front."""
+
+        return resolve_upload_paths(collect_upload_idents(self.data))
+
     @staticmethod
+    @functools.cache
     def get_emoji_tag(unicode_emoji: str) -> str:
         """Converts the `unicode emoji` into an `img` tag with the Twemoji SVG."""
 
+        # Twemoji drops the variation selector unless the emoji is a ZWJ sequence.
+        codepoints = (
+            unicode_emoji
+            if "\u200d" in unicode_emoji
+            else unicode_emoji.replace("\ufe0f", "")
+        )
+        filename = "-".join(f"{ord(char):x}" for char in codepoints)
+
         return (
             '<img class="emoji" src="https://cdnjs.cloudflare.com/ajax/libs/twemoji/15.1.0/svg/'
-            + (
-                "-".join(
-                    [
-                        codepoint.lstrip("0")
-                        for codepoint in unicode_emoji.encode("unicode_escape")
-                        .decode()
-                        .split("\\U")
-                        if codepoint != ""
-                    ]
-                )
-            )
+            + filename
             + f'.svg" alt="{unicode_emoji}" aria-label="{unicode_emoji}" draggable=false />'
         )
 
-    def flatten_inline(self, inline: InlineNode) -> str:
+    def write_text(self, text: str, out: list[str]) -> None:
+        """
+        Escapes `text`, expands `:shortcodes:` and replaces unicode emoji with
+        Twemoji images in a single scan.
         """
-        Flattens the InlineNode in a safe way.
 
-        Escapes strings
-        Join lists of nodes and recursively flatten them.
+        pattern = text_token_pattern()
+        names = emoji_by_name()
+        trie = emoji_trie()
+        pos = 0
 
-        For other types of nodes, generate the HTML equivalent for them.
-        If a node type is not implemented: returns the empty string
-        """
+        while (match := pattern.search(text, pos)) is not None:
+            start = match.start()
+            out.append(text[pos:start])
 
-        if isinstance(inline, str):
-            text = emoji.emojize(html.escape(inline))
-            offset = 0
+            if match["shortcode"] is not None:
+                if (unicode_emoji := names.get(match["shortcode"])) is not None:
+                    out.append(self.get_emoji_tag(unicode_emoji))
+                    pos = match.end()
 
-            for emoji_ in emoji.analyze(text):
-                if isinstance(emoji_.value, str):
-                    continue
+                else:
+                    # The closing colon may start a real shortcode.
+                    out.append(":")
+                    pos = start + 1
 
-                tag = self.get_emoji_tag(emoji_.chars)
+                continue
 
-                text = (
-                    text[: emoji_.value.start + offset]
-                    + tag
-                    + text[emoji_.value.end + offset :]
-                )
+            if match["escape"] is not None:
+                out.append(HTML_ESCAPES[match["escape"]])
+                pos = match.end()
+                continue
+
+            # Longest emoji starting here.
+            node, index, end = trie, start, None
+
+            while index < len(text) and (node := node.get(text[index])) is not None:
+                index += 1
+
+                if "" in node:
+                    end = index
+
+            if end is None:
+                out.append(html.escape(match[0]))
+                pos = match.end()
+
+            else:
+                out.append(self.get_emoji_tag(text[start:end]))
+                pos = end
+
+        out.append(text[pos:])
+
+    def flatten_text(self, text: str) -> str:
+        """:py:meth:`write_text` into a string."""
 
-                offset += len(tag) + emoji_.value.start - emoji_.value.end
+        out: list[str] = []
+        self.write_text(text, out)
 
-            return text
+        return "".join(out)
+
+    def write_inline(self, inline: InlineNode, out: list[str]) -> None:
+        """
+        Writes the InlineNode to `out` in a safe way.
+
+        Escapes strings
+        Recursively writes lists of nodes.
+
+        For other types of nodes, write the HTML equivalent for them.
+        If a node type is not implemented: raises NotImplementedError
+        """
+
+        if isinstance(inline, str):
+            self.write_text(inline, out)
+            return
 
         if isinstance(inline, list):
-            return "".join(self.flatten_inline(node) for node in inline)
+            for node in inline:
+                self.write_inline(node, out)
+
+            return
 
         match inline:
             case {"type": "italic", "content": content}:
-                return f"<em>{self.flatten_inline(content)}</em>"
+                out.append("<em>")
+                self.write_inline(content, out)
+                out.append("</em>")
 
             case {"type": "bold", "content": content}:
-                return f"<strong>{self.flatten_inline(content)}</strong>"
+                out.append("<strong>")
+                self.write_inline(content, out)
+                out.append("</strong>")
 
             case {"type": "underline", "content": content}:
-                return f"<u>{self.flatten_inline(content)}</u>"
+                out.append("<u>")
+                self.write_inline(content, out)
+                out.append("</u>")
 
             case {"type": "strikethrough", "content": content}:
-                return f"<s>{self.flatten_inline(content)}</s>"
+                out.append("<s>")
+                self.write_inline(content, out)
+                out.append("</s>")
 
             case {"type": "code", "content": content}:
-
-                return f"<code>{html.escape(content)}</code>"
-
-            case {"type": "code", "content": content, "lang": lang}:
                 # TODO: inline syntax highlighting???
-
-                return f"<code>{html.escape(content)}</code>"
+                out.append(f"<code>{html.escape(content)}</code>")
 
             case {"type": "emoji", "name": name}:
-                for unicode_emoji, names in emoji.EMOJI_DATA.items():
-                    if names["en"] == f":{name}:":
-                        return self.get_emoji_tag(unicode_emoji)
+                if (unicode_emoji := emoji_by_name().get(name)) is not None:
+                    out.append(self.get_emoji_tag(unicode_emoji))
 
-                return f":{name}:"
+                else:
+                    out.append(f":{name}:")
 
             case {"type": "link", "url": url, "label": label}:
-                return f'<a href="{html.escape(transform_url(url))}">{self.flatten_inline(label)}</a>'
+                out.append(
+                    f'<a href="{html.escape(transform_url(url, self.upload_paths))}">'
+                )
+                self.write_inline(label, out)
+                out.append("</a>")
 
             case {"type": "link", "url": url}:
-                return f'<a href="{html.escape(transform_url(url))}">{html.escape(url)}</a>'
+                out.append(
+                    f'<a href="{html.escape(transform_url(url, self.upload_paths))}">{html.escape(url)}</a>'
+                )
 
             case {"type": "image", "source": source, "alt": alt}:
-                return f'<img src="{html.escape(transform_url(source))}" alt="{self.flatten_inline(alt)}"/>'
+                out.append(
+                    f'<img src="{html.escape(transform_url(source, self.upload_paths))}" alt="'
+                )
+                self.write_inline(alt, out)
+                out.append('"/>')
 
             case {"type": "raw", "content": content}:
-                return content
+                out.append(content)
 
-        raise NotImplementedError(inline)
+            case _:
+                raise NotImplementedError(inline)
+
+    def flatten_inline(self, inline: InlineNode) -> str:
+        """:py:meth:`write_inline` into a string."""
+
+        out: list[str] = []
+        self.write_inline(inline, out)
+
+        return "".join(out)
 
     def get_inline_text(self, inline: InlineNode) -> str:
         """
@@ -296,11 +507,7 @@ class HTMLRenderer:
                 return self.get_inline_text(content)
 
             case {"type": "emoji", "name": name}:
-                for unicode_emoji, names in emoji.EMOJI_DATA.items():
-                    if names["en"] == f":{name}:":
-                        return unicode_emoji
-
-                return f":{name}:"
+                return emoji_by_name().get(name, f":{name}:")
 
             case {"type": "link", "label": label, "url": _url}:
                 return self.get_inline_text(label)
@@ -318,18 +525,34 @@ class HTMLRenderer:
 
         return self.flatten_block(self.data)
 
-    def flatten_block(self, node: Node) -> str:
-        if isinstance(node, Sequence):
-            out = ""
+    def iter_html(self) -> Iterator[str]:
+        """
+        Convert the AST in :py:attr self.data: to HTML, one top-level node at a
+        time, e.g. for a `StreamingHttpResponse`.
+        """
+
+        out: list[str] = []
 
-            for node in node:
-                out += self.flatten_block(node)
+        for node in self.data:
+            self.write_block(node, out)
 
-            return out
+            yield "".join(out)
+            out.clear()
+
+    def write_block(self, node: Node, out: list[str]) -> None:
+        """Writes the HTML for a block node to `out`."""
+
+        if isinstance(node, Sequence):
+            for child in node:
+                self.write_block(child, out)
+
+            return
 
         match node:
             case {"type": "paragraph", "content": content}:
-                return f"<p>{self.flatten_inline(content)}</p>"
+                out.append("<p>")
+                self.write_inline(content, out)
+                out.append("</p>")
 
             case {"type": "heading", "level": level, "content": content}:
                 # TODO: add IDs
@@ -351,39 +574,62 @@ class HTMLRenderer:
                     ),
                 ).strip("-")
 
-                return f'<h{level + 1} id="{heading_id}">{self.flatten_inline(content)}<a style="float: right;" href="#{heading_id}">#</a></h{level + 1}>'
+                out.append(f'<h{level + 1} id="{heading_id}">')
+                self.write_inline(content, out)
+                out.append(
+                    f'<a style="float: right;" href="#{heading_id}">#</a></h{level + 1}>'
+                )
 
             case {"type": "subtext", "content": content}:
-                return f'<p class="subtext">{self.flatten_inline(content)}</p>'
+                out.append('<p class="subtext">')
+                self.write_inline(content, out)
+                out.append("</p>")
 
             case {"type": "raw", "content": content}:
-                return content
+                out.append(content)
 
             case {"type": "code", "content": content, "lang": lang}:
                 # TODO: syntax highlighting
-                return f'<pre><code class="lang-{html.escape(lang)}">{html.escape(self.get_inline_text(content))}</code></pre>'
+                out.append(
+                    f'<pre><code class="lang-{html.escape(lang)}">{html.escape(self.get_inline_text(content))}</code></pre>'
+                )
 
             case {"type": "code", "content": content}:
-                return f"<pre><code>{html.escape(self.get_inline_text(content))}</code></pre>"
+                out.append(
+                    f"<pre><code>{html.escape(self.get_inline_text(content))}</code></pre>"
+                )
 
             case {"type": "horizontal_rule"}:
-                return "<hr />"
+                out.append("<hr />")
 
             case {"type": "blockquote", "content": content}:
-                return f"<blockquote>{self.flatten_block(content)}</blockquote>"
+                out.append("<blockquote>")
+                self.write_block(content, out)
+                out.append("</blockquote>")
 
             case {"type": "list", "ordered": ordered, "items": items}:
                 xl = "o" if ordered else "u"
 
-                converted_items = "".join(
-                    [f"<li>{self.flatten_block(item)}</li>" for item in items]
-                )
+                out.append(f"<{xl}l>")
+
+                for item in items:
+                    out.append("<li>")
+                    self.write_block(item, out)
+                    out.append("</li>")
 
-                return f"<{xl}l>{converted_items}</{xl}l>"
+                out.append(f"</{xl}l>")
 
             case _:
                 raise NotImplementedError(f"Invalid AST node {node!r}")
 
+    def flatten_block(self, node: Node) -> str:
+        """:py:meth:`write_block` into a string."""
+
+        out: list[str] = []
+        self.write_block(node, out)
+
+        return "".join(out)
+
 
 def marko_inline_to_ir(element: marko.element.Element | str) -> InlineNode | None:
     """
@@ -554,9 +800,109 @@ def parse(content: str, content_type: Article.ContentType) -> IRType:
     raise ValueError(f"Unknown content type: {content_type}")
 
 
+IR_VERSION = 1
+"""Bump this whenever the IR produced by :py:func:`parse` changes to recompile stored IR."""
+
+
+def dump_ir(ir: IRType) -> bytes:
+    """Serialize the IR into the compact form stored on articles."""
+
+    return zlib.compress(json.dumps(ir, separators=(",", ":")).encode("utf-8"))
+
+
+def load_ir(data: bytes | memoryview) -> IRType:
+    """Deserialize IR stored with :py:func:`dump_ir`."""
+
+    return json.loads(zlib.decompress(data))
+
+
+def content_hash(article: Article) -> str:
+    """Hash of what the IR of the article is compiled from."""
+
+    return hashlib.sha256(
+        f"{article.content_type}:{article.content}".encode("utf-8")
+    ).hexdigest()
+
+
+def compile_article(article: Article) -> None:
+    """
+    Parse the content of the article and store the IR on it (without saving).
+
+    Content that can't be parsed is left to fail when rendered.
+    """
+
+    try:
+        ir = parse(article.content, Article.ContentType(article.content_type))
+
+    except ValueError:
+        article.ir = None
+        article.ir_version = 0
+        article.ir_hash = ""
+        return
+
+    article.ir = dump_ir(ir)
+    article.ir_version = IR_VERSION
+    article.ir_hash = content_hash(article)
+
+
+def has_current_ir(article: Article) -> bool:
+    """Whether the stored IR is of this version and compiled from the current content."""
+
+    return (
+        article.ir is not None
+        and article.ir_version == IR_VERSION
+        and article.ir_hash == content_hash(article)
+    )
+
+
+def get_article_ir(article: Article) -> IRType:
+    """
+    The stored IR of the article, or freshly parsed IR if it is missing,
+    outdated or was compiled from other content.
+    """
+
+    if has_current_ir(article):
+        return load_ir(article.ir)
+
+    return parse(article.content, Article.ContentType(article.content_type))
+
+
+def iter_page(content: str, article: Article) -> Iterator[str]:
+    """
+    Render article content using the metadata from the article, in chunks.
+
+    Saved articles are served from the render cache when possible, and cached
+    once the last chunk has been rendered.
+    """
+
+    if article.pk is None:
+        parsed = parse(content, Article.ContentType(article.content_type))
+
+        yield from HTMLRenderer(parsed).iter_html()
+        return
+
+    fingerprint = render_cache.fingerprint(content, article.content_type)
+
+    if (rendered := render_cache.get(article.pk, fingerprint)) is not None:
+        yield rendered
+        return
+
+    if content == article.content:
+        parsed = get_article_ir(article)
+
+    else:
+        parsed = parse(content, Article.ContentType(article.content_type))
+
+    chunks = []
+
+    for chunk in HTMLRenderer(parsed).iter_html():
+        chunks.append(chunk)
+        yield chunk
+
+    render_cache.set(article.pk, fingerprint, "".join(chunks))
+
+
 def render_page(content: str, article: Article) -> str:
     """Render article content using the metadata from the article."""
 
-    parsed = parse(content, Article.ContentType(article.content_type))
-
-    return HTMLRenderer(parsed).to_html(article)
+    return "".join(iter_page(content, article))
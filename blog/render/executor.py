@@ -0,0 +1,58 @@
+"""
+A bounded thread pool for rendering from async views.
+
+Rendering is CPU-bound, so running it on the event loop would block every other
+request, and an unbounded number of threads would just fight over the GIL.
+"""
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import threading
+from typing import ParamSpec, TypeVar
+
+from django.conf import settings
+from django.db import close_old_connections
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+_executor: ThreadPoolExecutor | None = None
+_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor  # pylint: disable=global-statement
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RENDER_WORKERS, thread_name_prefix="render"
+            )
+
+        return _executor
+
+
+def _call(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    try:
+        return func(*args, **kwargs)
+
+    finally:
+        # Rendering may query uploads; don't leak connections from pool threads.
+        close_old_connections()
+
+
+async def run_in_render_pool(
+    func: Callable[P, T], *args: P.args, **kwargs: P.kwargs
+) -> T:
+    """Runs `func` in the render pool and waits for the result."""
+
+    # Like `asyncio.to_thread`, so context variables (e.g. the database reads
+    # go to, see `blog.routers`) carry over.
+    context = contextvars.copy_context()
+
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), functools.partial(context.run, _call, func, *args, **kwargs)
+    )
@@ -0,0 +1,136 @@
+"""
+Routing of public, read-only pages to a read-only database connection.
+
+Views marked with :py:func:`read_only` read from `settings.READ_ONLY_DATABASE`
+(the same SQLite file opened with `mode=ro`, or a replica of a database
+server), including while their response is streamed. Everything else, and
+every write, uses `default`.
+"""
+
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+from inspect import iscoroutinefunction
+from typing import Any
+
+from django.conf import settings
+from django.http.response import HttpResponseBase
+
+_database: ContextVar[str | None] = ContextVar("database", default=None)
+
+
+def get_read_only_database() -> str | None:
+    alias = getattr(settings, "READ_ONLY_DATABASE", None)
+
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def reading_only() -> Iterator[None]:
+    """Sends the reads in the block to the read-only database."""
+
+    token = _database.set(get_read_only_database())
+
+    try:
+        yield
+
+    finally:
+        _database.reset(token)
+
+
+async def read_only_async_stream(chunks: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    iterator = aiter(chunks)
+
+    while True:
+        with reading_only():
+            try:
+                chunk = await anext(iterator)
+
+            except StopAsyncIteration:
+                return
+
+        yield chunk
+
+
+def read_only_stream(chunks: Iterator[Any]) -> Iterator[Any]:
+    iterator = iter(chunks)
+
+    while True:
+        with reading_only():
+            try:
+                chunk = next(iterator)
+
+            except StopIteration:
+                return
+
+        yield chunk
+
+
+def read_only_response(response: HttpResponseBase) -> HttpResponseBase:
+    # Streamed content is generated after the view returned.
+    if response.streaming:
+        response.streaming_content = (  # type: ignore[attr-defined]
+            read_only_async_stream(response.streaming_content)  # type: ignore
+            if response.is_async  # type: ignore[attr-defined]
+            else read_only_stream(response.streaming_content)  # type: ignore
+        )
+
+    return response
+
+
+def read_only(view: Callable) -> Callable:
+    """Marks a view that doesn't write to the database to read from the read-only one."""
+
+    if iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> HttpResponseBase:
+            with reading_only():
+                response = await view(*args, **kwargs)
+
+            return read_only_response(response)
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> HttpResponseBase:
+        with reading_only():
+            response = view(*args, **kwargs)
+
+        return read_only_response(response)
+
+    return wrapper
+
+
+class ReadOnlyRouter:
+    """Routes reads inside :py:func:`reading_only` to the read-only database."""
+
+    def db_for_read(self, model: type, **hints: Any) -> str | None:
+        return _database.get()
+
+    def db_for_write(self, model: type, **hints: Any) -> str | None:
+        instance = hints.get("instance")
+        database = instance._state.db if instance is not None else None
+
+        # Instances read from the read-only database are saved to `default`,
+        # those of other databases to their own.
+        if database is None or database == get_read_only_database():
+            return "default"
+
+        return None
+
+    def allow_relation(self, obj1: Any, obj2: Any, **hints: Any) -> bool | None:
+        aliases = {"default", get_read_only_database()}
+
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+
+        return None
+
+    def allow_migrate(self, db: str, app_label: str, **hints: Any) -> bool | None:
+        # It's the same database, or a replica of it.
+        if db == get_read_only_database():
+            return False
+
+        return None
@@ -0,0 +1,121 @@
+"""
+Lookup table for custom paths (article `page_url`s and upload paths).
+
+The catch-all route would otherwise query both tables for every unmatched URL,
+including every bot probing for `/wp-login.php`.
+"""
+
+from collections import Counter
+import threading
+import time
+from typing import Literal, NamedTuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from .models import Article, Upload
+
+
+class Route(NamedTuple):
+    kind: Literal["article", "upload"]
+    id: int
+
+
+class RouteTable:
+    """
+    Maps custom paths (without the trailing slash) to what is served there.
+
+    Every process keeps its own copy, tagged with a generation in the shared
+    `render` cache that changes whenever an article or upload changes. Like the
+    tag versions of the page cache, generations are timestamps, so an evicted
+    generation never goes back to the one an old copy was loaded with.
+    """
+
+    GENERATION_KEY = "routes-generation"
+
+    def __init__(self, alias: str = "render"):
+        self.alias = alias
+        self._routes: dict[str, Route] = {}
+        self._generation: int | None = None
+        self._lock = threading.Lock()
+        self.stats: Counter[str] = Counter()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def key(path: str) -> str:
+        return path.rstrip("/")
+
+    def load(self) -> dict[str, Route]:
+        routes = {
+            self.key(path): Route("upload", pk)
+            for pk, path in Upload.objects.values_list("pk", "path")
+        }
+
+        # Articles win over uploads at the same path, like they always have.
+        routes.update(
+            (self.key(page_url), Route("article", pk))
+            for pk, page_url in Article.objects.filter(
+                page_url__isnull=False
+            ).values_list("pk", "page_url")
+        )
+
+        return routes
+
+    def resolve(self, path: str) -> Route | None:
+        """
+        The route for `path`, or None if nothing is served there.
+
+        Unknown paths are answered from memory too, so 404s (bots scanning for
+        `/.env` and friends) never touch the database.
+        """
+
+        generation = self.backend.get_or_set(
+            self.GENERATION_KEY, time.time_ns, timeout=None
+        )
+
+        with self._lock:
+            if generation != self._generation:
+                self._routes = self.load()
+                self._generation = generation
+                self.stats["reloads"] += 1
+
+            route = self._routes.get(self.key(path))
+            self.stats["found" if route is not None else "not_found"] += 1
+
+            return route
+
+    async def aresolve(self, path: str) -> Route | None:
+        return await sync_to_async(self.resolve)(path)
+
+    def invalidate(self) -> None:
+        self.backend.set(self.GENERATION_KEY, time.time_ns(), timeout=None)
+
+        with self._lock:
+            self._generation = None
+
+    def get_stats(self) -> dict[str, int | float]:
+        """Lookup counters for this process, and how many lookups were answered from memory."""
+
+        with self._lock:
+            stats: dict[str, int | float] = {
+                "found": 0,
+                "not_found": 0,
+                "reloads": 0,
+                **self.stats,
+            }
+
+        lookups = self.stats["found"] + self.stats["not_found"]
+
+        stats["lookups"] = lookups
+        stats["hit_rate"] = (
+            (lookups - self.stats["reloads"]) / lookups if lookups else 0.0
+        )
+        stats["routes"] = len(self._routes)
+
+        return stats
+
+
+route_table = RouteTable()
@@ -0,0 +1,191 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from taggit.models import Tag
+
+from .cache import render_cache, seo_cache
+from .dependencies import (
+    STATE_FIELDS,
+    article_dependency,
+    article_state,
+    changed_dependencies,
+)
+from .models import Article, Comment, Upload, refresh_comment_counts
+from .pagecache import page_cache
+from .pagination import is_listed, listed_count
+from .routes import route_table
+
+
+@receiver(pre_save, sender=Article)
+def remember_article_state(sender, instance: Article, **kwargs):
+    # Listings (and the cached count of listed articles) are only invalidated
+    # when what they show changed.
+    instance.previous_state = (
+        Article.objects.filter(pk=instance.pk).values(*STATE_FIELDS).first()
+        if instance.pk is not None
+        else None
+    )
+
+
+@receiver(post_save, sender=Article)
+def refresh_listed_count(sender, instance: Article, **kwargs):
+    previous_state = getattr(instance, "previous_state", None)
+
+    if is_listed(previous_state) != is_listed(article_state(instance)):
+        transaction.on_commit(listed_count.refresh)
+
+
+@receiver(post_delete, sender=Article)
+def refresh_listed_count_on_delete(sender, instance: Article, **kwargs):
+    transaction.on_commit(listed_count.refresh)
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def invalidate_article(sender, instance: Article, signal, **kwargs):
+    article_id = instance.pk
+    dependencies = changed_dependencies(instance, deleted=signal is post_delete)
+
+    def invalidate():
+        render_cache.invalidate(article_id)
+        seo_cache.invalidate(article_id)
+        page_cache.invalidate(*dependencies)
+        route_table.invalidate()
+
+    # Only once the change is visible, or a request could load the old rows
+    # and keep them under the new versions.
+    transaction.on_commit(invalidate)
+
+
+@receiver(pre_save, sender=Upload)
+def remember_upload_ident(sender, instance: Upload, **kwargs):
+    # Pages linking to the old ident change too when an upload is renamed.
+    instance.previous_ident = (
+        Upload.objects.filter(pk=instance.pk).values_list("ident", flat=True).first()
+        if instance.pk is not None
+        else None
+    )
+
+
+@receiver(post_save, sender=Upload)
+@receiver(post_delete, sender=Upload)
+def invalidate_upload(sender, instance: Upload, **kwargs):
+    dependencies = changed_dependencies(instance)
+
+    def invalidate():
+        render_cache.invalidate_uploads()
+        page_cache.invalidate(*dependencies)
+        route_table.invalidate()
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Article)
+def recount_article_comments(
+    sender, instance: Article, created: bool, update_fields=None, **kwargs
+):
+    # Saving writes back the counts the article was loaded with, which a
+    # comment may have changed in the meantime.
+    if not created and update_fields is None:
+        refresh_comment_counts(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def update_comment_counts(sender, instance: Comment, **kwargs):
+    refresh_comment_counts(instance.article_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance: Comment, created: bool = False, **kwargs):
+    # New comments wait for approval, so they don't change the page yet.
+    if created and not instance.active:
+        return
+
+    transaction.on_commit(
+        partial(page_cache.invalidate, *changed_dependencies(instance))
+    )
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def invalidate_article_tags(
+    sender, instance, action: str, reverse: bool, pk_set, **kwargs
+):
+    if not action.startswith("post_"):
+        return
+
+    if isinstance(instance, Article):
+        article_ids = [instance.pk]
+
+    else:
+        article_ids = list(pk_set or ())
+
+    def invalidate():
+        # Listings record the tags they show, so only the articles' own pages change.
+        seo_cache.invalidate(*article_ids)
+        page_cache.invalidate(*map(article_dependency, article_ids))
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag(sender, instance: Tag, **kwargs):
+    transaction.on_commit(
+        partial(page_cache.invalidate, *changed_dependencies(instance))
+    )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def invalidate_tag_seo(sender, instance: Tag, **kwargs):
+    # Found before deleting, as the tagged articles can't be found afterwards.
+    article_ids = list(
+        Article.objects.filter(tags=instance).values_list("pk", flat=True)
+    )
+    transaction.on_commit(partial(seo_cache.invalidate, *article_ids))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_author(sender, instance, update_fields=None, **kwargs):
+    # Logging in only updates `last_login`, which no page shows.
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+
+    article_ids = list(
+        Article.objects.filter(author=instance).values_list("pk", flat=True)
+    )
+    dependencies = changed_dependencies(instance)
+
+    def invalidate():
+        seo_cache.invalidate(*article_ids)
+        page_cache.invalidate(*dependencies)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+
+    read_only = "mode=ro" in str(connection.settings_dict["NAME"])
+
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            # Only writable connections can change the journal mode of the file.
+            if read_only and pragma == "journal_mode":
+                continue
+
+            cursor.execute(f"PRAGMA {pragma} = {value}")
@@ -1,3 +1,1160 @@
-from django.test import TestCase
+from datetime import datetime, timezone as dt_timezone
+import html
+from io import StringIO
+from pathlib import Path
+import re
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.admin import AdminSite
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+
+from taggit.models import Tag
+
+from kazani.models import User
+from .admin import CommentAdmin
+from .cache import render_cache, seo_cache
+from .dependencies import (
+    LIST_DEPENDENCY,
+    DependencyGraph,
+    article_dependency,
+    changed_dependencies,
+    summary_dependency,
+)
+from .intake import comment_intake
+from .management.commands.bench_text import legacy_flatten_text
+from .management.commands.export_site import Command as ExportCommand, collect
+from .models import Article, Comment, Upload, refresh_comment_counts
+from .pagecache import negotiate_encoding, page_cache
+from .pagination import listed_count
+from .render import (
+    IR_VERSION,
+    HTMLRenderer,
+    content_hash,
+    get_article_ir,
+    has_current_ir,
+    iter_page,
+    load_ir,
+    parse,
+    resolve_upload_paths,
+)
+from .routes import RouteTable, route_table
+from .routers import ReadOnlyRouter, read_only, reading_only
+from .views import if_range_matches, parse_range
+
+
+@override_settings(
+    # The queries are what matters here, not the stylesheets.
+    COMPRESS_ENABLED=False,
+    COMPRESS_PRECOMPILERS=(),
+    # The read-only connection can't see the data of a test's transaction.
+    READ_ONLY_DATABASE=None,
+    PAGE_CACHE_HOSTS=["testserver"],
+    # Separate caches in memory, instead of the real ones in `.cache`.
+    CACHES={
+        alias: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": alias,
+        }
+        for alias in ("default", "render", "pages")
+    },
+)
+class BlogTestCase(TestCase):
+    """Base class of the tests that go through views, models and signals."""
+
+    def setUp(self):
+        # Invalidations wait for a commit, which never comes in tests.
+        for alias in ("default", "render", "pages"):
+            caches[alias].clear()
+
+    def use_temporary_media_root(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        overrides = override_settings(MEDIA_ROOT=directory.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
+class ArticleListQueryTests(BlogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [User.objects.create(username=f"Author{i}") for i in range(3)]
+
+    def create_articles(self, count: int) -> None:
+        for i in range(count):
+            article = Article.objects.create(
+                title=f"Article {i}",
+                slug=f"article-{i}",
+                content=f"Article number {i}.",
+                author=self.authors[i % len(self.authors)],
+                is_hidden=False,
+            )
+            article.tags.add(f"tag{i}", "common")
+
+    def count_list_queries(self) -> int:
+        caches["pages"].clear()
+        caches["render"].clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("articles"))
+
+        self.assertEqual(response.status_code, 200)
+
+        return len(queries)
+
+    def test_queries_do_not_grow_with_page_size(self):
+        self.create_articles(2)
+        small = self.count_list_queries()
+
+        Article.objects.all().delete()
+        self.create_articles(10)
+        full = self.count_list_queries()
+
+        self.assertEqual(small, full)
+
+    def test_seo_uses_prefetched_data(self):
+        self.create_articles(10)
+
+        response = self.client.get(reverse("articles"))
+
+        self.assertContains(response, '"keywords"')
+        self.assertContains(response, "common", count=10)
+        self.assertContains(response, "Author2")
+
+    def test_seo_follows_tag_renames(self):
+        self.create_articles(3)
+        self.client.get(reverse("articles"))
+
+        tag = Tag.objects.get(name="common")
+        tag.name = "renamed"
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.save()
+
+        response = self.client.get(reverse("articles"))
+
+        self.assertContains(response, "renamed", count=3)
+        self.assertNotContains(response, "common")
+
+    def test_seo_cached_per_host(self):
+        self.create_articles(1)
+        article = Article.objects.get()
+
+        for host in ("a.example", "b.example"):
+            response = self.client.get(reverse("articles"), HTTP_HOST=host)
+
+            self.assertContains(response, f"https://{host}/")
+            self.assertIsNotNone(caches["render"].get(seo_cache.key(article.pk, host)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            article.tags.set(["renamed"])
+
+        for host in ("a.example", "b.example"):
+            response = self.client.get(reverse("articles"), HTTP_HOST=host)
+
+            self.assertContains(response, "renamed")
+
+    def test_seo_cannot_close_the_script(self):
+        self.create_articles(1)
+        Article.objects.update(title="</script><script>alert(1)</script>")
+
+        response = self.client.get(reverse("articles"))
+
+        self.assertNotContains(response, "</script><script>alert(1)")
+
+
+@override_settings(ARTICLE_LIST_PAGINATION="keyset")
+class KeysetPaginationTests(BlogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username="Author")
+        # Some articles share a timestamp, so the id has to break ties.
+        created = timezone.now()
+
+        for i in range(25):
+            article = Article.objects.create(
+                title=f"Article {i}",
+                slug=f"article-{i}",
+                content=f"Article number {i}.",
+                author=author,
+                is_hidden=False,
+            )
+            Article.objects.filter(pk=article.pk).update(
+                created=created - timezone.timedelta(minutes=i // 2)
+            )
+
+    def get_titles(self, response) -> list[str]:
+        return [article.title for article in response.context["object_list"]]
+
+    def test_pages_follow_each_other(self):
+        titles = []
+        url = reverse("articles")
+
+        while url:
+            response = self.client.get(url)
+            titles.extend(self.get_titles(response))
+            url = response.context["page_urls"]["next"]
+
+        self.assertEqual(
+            titles,
+            list(
+                Article.objects.order_by("-created", "-id").values_list(
+                    "title", flat=True
+                )
+            ),
+        )
+
+    def test_previous_page(self):
+        first = self.client.get(reverse("articles"))
+        second = self.client.get(first.context["page_urls"]["next"])
+        third = self.client.get(second.context["page_urls"]["next"])
+
+        self.assertEqual(second.context["page_urls"]["previous"], reverse("articles"))
+        self.assertEqual(
+            third.context["page_urls"]["previous"], first.context["page_urls"]["next"]
+        )
+
+    def test_deep_pages_cost_the_same(self):
+        first = self.client.get(reverse("articles"))
+        second = self.client.get(first.context["page_urls"]["next"])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(second.context["page_urls"]["next"])
+
+        deep = len(queries)
+        caches["pages"].clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first.context["page_urls"]["next"])
+
+        self.assertEqual(deep, len(queries))
+        self.assertFalse(
+            any("COUNT" in query["sql"] for query in queries.captured_queries)
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("articles"), {"after": "not-a-cursor!"})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_out_of_range_cursor(self):
+        for cursor in ("ZZZZZZZZZZZZZZZZ-1", "1-ZZZZZZZZZZZZZZZZ"):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse("articles"), {"after": cursor})
+
+                self.assertEqual(response.status_code, 404)
+
+    def test_count_refreshed_on_hide(self):
+        self.assertEqual(listed_count.get(), 25)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            article = Article.objects.get(slug="article-3")
+            article.is_hidden = True
+            article.save()
+
+        self.assertEqual(listed_count.get(), 24)
+
+    def test_count_not_refreshed_on_edits(self):
+        article = Article.objects.get(slug="article-3")
+        article.title = "Renamed"
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            article.save()
+
+        self.assertNotIn(listed_count.refresh, callbacks)
+
+
+class CommentCountTests(BlogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.article = Article.objects.create(
+            title="Article", slug="article", content="Content.", is_hidden=False
+        )
+
+    def add_comment(self, active: bool = False) -> Comment:
+        return Comment.objects.create(
+            article=self.article,
+            name="Name",
+            email="name@example.com",
+            content="Comment.",
+            active=active,
+        )
+
+    def assertCounts(self, active: int, pending: int) -> None:
+        self.article.refresh_from_db()
+
+        self.assertEqual(
+            (self.article.active_comment_count, self.article.pending_comment_count),
+            (active, pending),
+        )
+
+    def test_counts_follow_comments(self):
+        pending = self.add_comment()
+        self.add_comment()
+        active = self.add_comment(active=True)
+        self.assertCounts(1, 2)
+
+        pending.active = True
+        pending.save()
+        self.assertCounts(2, 1)
+
+        active.delete()
+        self.assertCounts(1, 1)
+
+    def test_bulk_approve(self):
+        for _ in range(3):
+            self.add_comment()
+
+        admin = CommentAdmin(Comment, AdminSite())
+        admin.approve_comments(None, Comment.objects.all())
+
+        self.assertCounts(3, 0)
+
+    def test_saving_the_article_keeps_counts(self):
+        stale = Article.objects.get(pk=self.article.pk)
+        self.add_comment(active=True)
+
+        stale.title = "Renamed"
+        stale.save()
+
+        self.assertCounts(1, 0)
+
+    def test_email_hash(self):
+        comment = self.add_comment(active=True)
+
+        self.assertEqual(comment.email_hash, "a130ced3f36ffd4604f4dae04b2b3bcd")
+
+
+class CommentPageTests(BlogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.article = Article.objects.create(
+            title="Article",
+            slug="article",
+            content="Content.",
+            author=User.objects.create(username="Author"),
+            is_hidden=False,
+        )
+        Comment.objects.bulk_create(
+            Comment(
+                article=cls.article,
+                name=f"Commenter {i}",
+                email="name@example.com",
+                content=f"Comment {i}.",
+                active=True,
+            )
+            for i in range(45)
+        )
+        refresh_comment_counts(cls.article.pk)
+
+    def get_names(self, body: str) -> list[str]:
+        return re.findall(r">(Commenter \d+)<", body)
+
+    def test_pages(self):
+        response = self.client.get(self.article.get_absolute_url())
+        body = async_to_sync(collect)(response.streaming_content).decode()
+        names = self.get_names(body)
+
+        self.assertEqual(len(set(names)), 20)
+
+        while url := re.search(r"more-comments[^>]*href=\"?([^\" >]+)", body):
+            body = self.client.get(html.unescape(url[1])).content.decode()
+            names.extend(self.get_names(body))
+
+        self.assertEqual(
+            names,
+            list(
+                Comment.objects.order_by("-created", "-id").values_list(
+                    "name", flat=True
+                )
+            ),
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse("article-comments", args=[self.article.pk]), {"after": "nope!"}
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_out_of_range_cursor(self):
+        response = self.client.get(
+            reverse("article-comments", args=[self.article.pk]),
+            {"after": "ZZZZZZZZZZZZZZZZ-1"},
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+
+class CommentIntakeTests(BlogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.article = Article.objects.create(
+            title="Article",
+            slug="article",
+            content="Content.",
+            author=User.objects.create(username="Author"),
+            is_hidden=False,
+        )
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        overrides = override_settings(
+            COMMENT_INTAKE_PATH=Path(directory.name) / "intake.sqlite3",
+            COMMENT_INTAKE_WORKER=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def submit(self, name: str):
+        return self.client.post(
+            self.article.get_absolute_url(),
+            {"name": name, "email": "name@example.com", "content": "Comment."},
+        )
+
+    def test_submissions_are_queued(self):
+        response = self.submit("First")
+        self.submit("Second")
+
+        self.assertRedirects(
+            response,
+            f"{self.article.get_absolute_url()}#comments",
+            fetch_redirect_response=False,
+        )
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(comment_intake.pending(), 2)
+
+        self.assertEqual(comment_intake.drain(batch_size=1), 2)
+
+        self.assertEqual(comment_intake.pending(), 0)
+        self.assertEqual(
+            list(Comment.objects.order_by("pk").values_list("name", "active")),
+            [("First", False), ("Second", False)],
+        )
+        self.assertEqual(
+            Comment.objects.first().email_hash, "a130ced3f36ffd4604f4dae04b2b3bcd"
+        )
+
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.pending_comment_count, 2)
+
+    def test_failed_batches_are_kept(self):
+        self.submit("Name")
+
+        with mock.patch.object(
+            comment_intake, "add_comments", side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            comment_intake.drain()
+
+        self.assertEqual(comment_intake.pending(), 1)
+        self.assertEqual(comment_intake.drain(), 1)
+        self.assertTrue(Comment.objects.exists())
+
+    def test_abandoned_claims_are_claimed_again(self):
+        self.submit("Name")
+        # A process that was stopped while adding the batch.
+        self.assertEqual(len(comment_intake.claim(10)), 1)
+
+        self.assertEqual(comment_intake.pending(), 1)
+        self.assertEqual(comment_intake.drain(), 0)
+        self.assertEqual(comment_intake.drain(claim_timeout=0), 1)
+        self.assertEqual(comment_intake.pending(), 0)
+
+    def test_comments_on_deleted_articles_are_dropped(self):
+        self.submit("Name")
+        self.article.delete()
+
+        self.assertEqual(comment_intake.drain(), 1)
+        self.assertFalse(Comment.objects.exists())
+
+
+class ArticleETagTests(BlogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username="Author")
+        cls.article = Article.objects.create(
+            title="Article",
+            slug="article",
+            content="Content.",
+            author=cls.author,
+            is_hidden=False,
+        )
+        cls.comment = Comment.objects.create(
+            article=cls.article,
+            name="Name",
+            email="name@example.com",
+            content="Comment.",
+            active=True,
+        )
+
+    def get(self, etag: str | None = None):
+        headers = {"If-None-Match": etag} if etag else {}
+
+        return self.client.get(self.article.get_absolute_url(), headers=headers)
+
+    def assertChangesETag(self, change) -> None:
+        # The first response sets the CSRF cookie, which is part of the ETag.
+        self.get()
+        etag = self.get()["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+
+        self.assertEqual(self.get(etag).status_code, 200)
+
+    def test_tags(self):
+        self.assertChangesETag(lambda: self.article.tags.add("new"))
+
+    def test_tag_renames(self):
+        self.article.tags.add("old")
+        tag = Tag.objects.get(name="old")
+        tag.name = "renamed"
+
+        self.assertChangesETag(tag.save)
+
+    def test_author(self):
+        self.author.username = "Renamed"
+
+        self.assertChangesETag(self.author.save)
+
+    def test_comment_edits(self):
+        self.comment.content = "Edited."
+
+        self.assertChangesETag(self.comment.save)
+
+
+class PageCacheKeyTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+
+    def is_stored(self, path: str) -> bool:
+        return (
+            page_cache.backend.get(page_cache.key(self.factory.get(path))) is not None
+        )
+
+    def test_only_read_parameters_are_keyed(self):
+        self.assertEqual(
+            page_cache.key(self.factory.get("/articles/?after=A-1&page=2")),
+            page_cache.key(self.factory.get("/articles/?page=2&after=A-1")),
+        )
+        self.assertNotEqual(
+            page_cache.key(self.factory.get("/articles/?page=2")),
+            page_cache.key(self.factory.get("/articles/")),
+        )
+
+    def test_canonical_keys(self):
+        self.assertEqual(
+            page_cache.key(self.factory.get("/articles/?page=02")),
+            page_cache.key(self.factory.get("/articles/?page=2")),
+        )
+        self.assertEqual(
+            page_cache.key(self.factory.get("/articles/?page=1")),
+            page_cache.key(self.factory.get("/articles/")),
+        )
+        self.assertEqual(
+            page_cache.key(self.factory.get("/articles/", HTTP_HOST="TestServer")),
+            page_cache.key(self.factory.get("/articles/")),
+        )
+        self.assertIsNone(page_cache.key(self.factory.get("/articles/?page=x")))
+        self.assertIsNone(page_cache.key(self.factory.get("/articles/?after=x")))
+        self.assertIsNone(
+            page_cache.key(self.factory.get("/articles/", HTTP_HOST="made.up"))
+        )
+
+    def test_unknown_hosts_bypass_the_cache(self):
+        with mock.patch.object(page_cache, "set") as set:
+            response = self.client.get(reverse("articles"), HTTP_HOST="made.up")
+
+        self.assertEqual(response.status_code, 200)
+        set.assert_not_called()
+        # What the page was rendered from is still known, for `export_site`.
+        self.assertTrue(response.page_cache_tags)
+
+    def test_other_parameters_bypass_the_cache(self):
+        self.client.get(reverse("articles"), {"utm_source": "feed"})
+        self.assertFalse(self.is_stored(f"{reverse('articles')}?utm_source=feed"))
+
+        self.client.get(reverse("articles"))
+        self.assertTrue(self.is_stored(reverse("articles")))
+
+
+class ArticleIRTests(BlogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username="Author")
+
+    def create_article(self, content: str) -> Article:
+        article = Article.objects.create(
+            title="Article", slug="article", content=content, author=self.author
+        )
+
+        return Article.objects.get(pk=article.pk)
+
+    def test_compiled_on_save(self):
+        article = self.create_article("Some *content*.")
+
+        self.assertEqual(article.ir_version, IR_VERSION)
+        self.assertEqual(article.ir_hash, content_hash(article))
+        self.assertEqual(
+            load_ir(article.ir),
+            parse(article.content, Article.ContentType(article.content_type)),
+        )
+
+    def test_stored_ir_is_loaded(self):
+        article = self.create_article("Some *content*.")
+
+        with mock.patch("blog.render.parse") as parse_:
+            get_article_ir(article)
+
+        parse_.assert_not_called()
+
+    def test_content_changed_without_saving(self):
+        article = self.create_article("Old content.")
+        Article.objects.filter(pk=article.pk).update(content="New content.")
+        article.refresh_from_db()
+
+        self.assertFalse(has_current_ir(article))
+        self.assertEqual(
+            get_article_ir(article),
+            parse("New content.", Article.ContentType(article.content_type)),
+        )
+
+    def test_compile_ir(self):
+        changed = self.create_article("Old content.")
+        Article.objects.filter(pk=changed.pk).update(content="New content.")
+        missing = self.create_article("Content.")
+        Article.objects.filter(pk=missing.pk).update(ir=None, ir_version=0)
+        current = self.create_article("Content.")
+        stdout = StringIO()
+
+        call_command("compile_ir", stdout=stdout)
+
+        self.assertIn("Compiled 2 articles (0 failed).", stdout.getvalue())
+
+        for article in (changed, missing, current):
+            article.refresh_from_db()
+            self.assertTrue(has_current_ir(article))
+
+
+class ExportSiteTests(BlogTestCase):
+    def test_custom_paths_of_hidden_articles(self):
+        author = User.objects.create(username="Author")
+        listed = Article.objects.create(
+            title="Listed", slug="listed", content=".", author=author, is_hidden=False
+        )
+        Article.objects.create(
+            title="About", slug="about", content=".", author=author, page_url="/about/"
+        )
+        Article.objects.create(
+            title="Hidden", slug="hidden", content=".", author=author
+        )
+
+        urls = ExportCommand().get_urls()
+
+        self.assertIn(ExportCommand.article_url(listed), urls)
+        self.assertIn("/about/", urls)
+        self.assertFalse(any("hidden" in url for url in urls))
+
+
+class DependencyTests(BlogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.article = Article.objects.create(
+            title="Article",
+            slug="article",
+            content="Content.",
+            author=User.objects.create(username="Author"),
+            is_hidden=False,
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.article.refresh_from_db()
+        self.graph = DependencyGraph(
+            {
+                "/articles/": {
+                    LIST_DEPENDENCY: 1,
+                    article_dependency(self.article.pk): 1,
+                },
+                "/feed/": {LIST_DEPENDENCY: 1, summary_dependency(self.article.pk): 1},
+                "/article/": {article_dependency(self.article.pk): 1},
+            }
+        )
+
+    def save(self, **fields) -> set[str]:
+        for field, value in fields.items():
+            setattr(self.article, field, value)
+
+        self.article.save()
+
+        return self.graph.pages_for(self.article)
+
+    def test_content_edits(self):
+        self.assertEqual(self.save(content="Edited."), {"/articles/", "/article/"})
+
+    def test_title_edits(self):
+        self.assertEqual(
+            self.save(title="Renamed"), {"/articles/", "/feed/", "/article/"}
+        )
+
+    def test_hiding(self):
+        self.assertEqual(
+            self.save(is_hidden=True), {"/articles/", "/feed/", "/article/"}
+        )
+
+    def test_deleting(self):
+        self.assertEqual(
+            self.graph.pages_for(self.article, deleted=True),
+            {"/articles/", "/feed/", "/article/"},
+        )
+
+    def test_new_hidden_articles(self):
+        article = Article.objects.create(title="Hidden", slug="hidden", content=".")
+
+        self.assertEqual(self.graph.pages_for(article), set())
+        self.assertNotIn(LIST_DEPENDENCY, changed_dependencies(article))
+
+    def test_invalidated_on_commit(self):
+        dependency = article_dependency(self.article.pk)
+        versions = page_cache.tag_versions([dependency])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.save()
+
+            self.assertEqual(page_cache.tag_versions([dependency]), versions)
+
+        self.assertNotEqual(page_cache.tag_versions([dependency]), versions)
+
+    def test_tags_do_not_change_listings(self):
+        versions = page_cache.tag_versions([LIST_DEPENDENCY])
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.article.tags.add("new")
+
+        self.assertTrue(callbacks)
+
+        self.assertEqual(page_cache.tag_versions([LIST_DEPENDENCY]), versions)
+
+    def test_is_stale(self):
+        versions = {LIST_DEPENDENCY: 1, article_dependency(self.article.pk): 1}
+
+        self.assertFalse(self.graph.is_stale("/articles/", versions))
+        self.assertTrue(
+            self.graph.is_stale("/articles/", {**versions, LIST_DEPENDENCY: 2})
+        )
+        self.assertTrue(self.graph.is_stale("/articles/", {LIST_DEPENDENCY: 1}))
+        self.assertTrue(self.graph.is_stale("/unknown/", versions))
+
+
+class RenderCacheInvalidationTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media_root()
+
+        self.upload = Upload(ident="image", path="/old.png")
+        self.upload.content.save("image.png", ContentFile(b"image"))
+        self.article = Article.objects.create(
+            title="Article",
+            slug="article",
+            content="[Image]($image)",
+            author=User.objects.create(username="Author"),
+        )
+        # Forget the paths other tests left in the process-wide ident cache.
+        render_cache.invalidate_uploads()
+
+    def render(self) -> str:
+        return "".join(iter_page(self.article.content, self.article))
+
+    def fingerprint(self) -> str:
+        return render_cache.fingerprint(self.article.content, self.article.content_type)
+
+    def is_cached_locally(self) -> bool:
+        # pylint: disable-next=protected-access
+        return self.article.pk in render_cache._local
+
+    def test_article_saves(self):
+        self.render()
+        fingerprint = self.fingerprint()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.title = "Renamed"
+            self.article.save()
+
+            # Still cached until the change is committed.
+            self.assertTrue(self.is_cached_locally())
+
+        self.assertFalse(self.is_cached_locally())
+        self.assertIsNone(render_cache.backend.get(render_cache.key(self.article.pk)))
+        self.assertIsNone(render_cache.get(self.article.pk, fingerprint))
+
+    def test_upload_changes(self):
+        self.assertIn('href="/old.png"', self.render())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload.path = "/new.png"
+            self.upload.save()
+
+        self.assertFalse(self.is_cached_locally())
+        # The file cache entry is left behind, but for an old upload generation.
+        self.assertIsNotNone(
+            render_cache.backend.get(render_cache.key(self.article.pk))
+        )
+        self.assertIsNone(render_cache.get(self.article.pk, self.fingerprint()))
+        self.assertIn('href="/new.png"', self.render())
+
+
+class UploadPathTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media_root()
+        render_cache.invalidate_uploads()
+
+        for ident, path in (
+            ("a", "/a.png"),
+            ("b", "/b.png"),
+            # The oldest of uploads sharing an ident wins.
+            ("shared", "/shared-old.png"),
+            ("shared", "/shared-new.png"),
+        ):
+            upload = Upload(ident=ident, path=path)
+            upload.content.save(f"{ident}.png", ContentFile(b"image"))
+
+    def test_one_query(self):
+        expected = {
+            "a": "/a.png",
+            "b": "/b.png",
+            "shared": "/shared-old.png",
+            "missing": "",
+        }
+
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_upload_paths(set(expected)), expected)
+
+        # Answered from the ident cache.
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_upload_paths(set(expected)), expected)
+
+    def test_render_resolves_once(self):
+        renderer = HTMLRenderer(
+            parse(
+                "[A]($a) [B]($b) [A again]($a) ![Shared]($shared)",
+                Article.ContentType.MARKDOWN,
+            )
+        )
+
+        with self.assertNumQueries(1):
+            rendered = "".join(renderer.iter_html())
+
+        self.assertEqual(rendered.count('href="/a.png"'), 2)
+        self.assertIn('src="/shared-old.png"', rendered)
+
+
+class GenerationTests(BlogTestCase):
+    def test_evicted_upload_generation(self):
+        fingerprint = render_cache.fingerprint("Content.", 0)
+        render_cache.invalidate_uploads()
+        render_cache.backend.delete(render_cache.UPLOADS_GENERATION_KEY)
+
+        self.assertNotEqual(render_cache.fingerprint("Content.", 0), fingerprint)
+
+    def test_evicted_route_generation(self):
+        # The copy of another process, loaded before the change.
+        other = RouteTable()
+        other.resolve("/")
+        route_table.invalidate()
+        route_table.backend.delete(route_table.GENERATION_KEY)
+
+        other.resolve("/")
+
+        self.assertEqual(other.stats["reloads"], 2)
+
+    def test_route_generation_bumped_on_commit(self):
+        route_table.resolve("/")
+        generation = route_table.backend.get(route_table.GENERATION_KEY)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Article.objects.create(
+                title="Article",
+                slug="article",
+                content="Content.",
+                page_url="/custom/",
+                author=User.objects.create(username="Author"),
+            )
+
+            # Other processes would reload the old rows under a new generation.
+            self.assertEqual(
+                route_table.backend.get(route_table.GENERATION_KEY), generation
+            )
+
+        self.assertEqual(route_table.resolve("/custom/").kind, "article")
+
+
+class RangeTests(SimpleTestCase):
+    modified = datetime(2024, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc)
+
+    def test_parse_range(self):
+        for header, expected in (
+            ("bytes=0-99", (0, 100)),
+            ("bytes=10-", (10, 1000)),
+            ("bytes=990-2000", (990, 1000)),
+            # Suffix ranges are the last bytes, or the whole file if it's shorter.
+            ("bytes=-100", (900, 1000)),
+            ("bytes=-5000", (0, 1000)),
+            # Ignored, so the whole file is sent.
+            ("bytes=99-10", None),
+            ("bytes=0-1,5-9", None),
+            ("bytes=-", None),
+            ("items=0-1", None),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 1000), expected)
+
+    def test_unsatisfiable_ranges(self):
+        for header in ("bytes=1000-", "bytes=2000-3000", "bytes=-0"):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                parse_range(header, 1000)
+
+    def if_range(self, value: str | None, etag: str | None = '"abc"') -> bool:
+        headers = {"If-Range": value} if value is not None else {}
+
+        return if_range_matches(
+            RequestFactory().get("/", headers=headers), etag, self.modified
+        )
+
+    def test_if_range(self):
+        self.assertTrue(self.if_range(None))
+        self.assertTrue(self.if_range('"abc"'))
+        self.assertFalse(self.if_range('"other"'))
+        self.assertFalse(self.if_range('"abc"', etag=None))
+        # Weak ETags never match, even an identical one.
+        self.assertFalse(self.if_range('W/"abc"'))
+        self.assertFalse(self.if_range('W/"abc"', etag='W/"abc"'))
+
+        self.assertTrue(self.if_range(http_date(self.modified.timestamp())))
+        self.assertFalse(self.if_range(http_date(self.modified.timestamp() + 1)))
+        self.assertFalse(self.if_range("not a date"))
+
+
+class UploadRangeTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media_root()
+
+        overrides = override_settings(UPLOAD_SENDFILE_HEADER=None)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.upload = Upload(ident="file", path="/file.txt")
+        self.upload.content.save("file.txt", ContentFile(b"0123456789"))
+
+    def get(self, **headers):
+        response = self.client.get("/file.txt", headers=headers)
+        body = (
+            async_to_sync(collect)(response.streaming_content)
+            if response.streaming
+            else b""
+        )
+
+        return response, body
+
+    def test_ranges(self):
+        response, body = self.get(Range="bytes=2-4")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b"234")
+        self.assertEqual(response["Content-Range"], "bytes 2-4/10")
+
+        response, body = self.get(Range="bytes=-3")
+        self.assertEqual((response.status_code, body), (206, b"789"))
+
+    def test_ignored_ranges(self):
+        for header in ("bytes=0-1,4-5", "bytes=5-2"):
+            with self.subTest(header=header):
+                response, body = self.get(Range=header)
+
+                self.assertEqual((response.status_code, body), (200, b"0123456789"))
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range="bytes=10-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_if_range(self):
+        etag = self.get()[0]["ETag"]
+
+        self.assertEqual(self.get(Range="bytes=0-0", If_Range=etag)[1], b"0")
+        self.assertEqual(
+            self.get(Range="bytes=0-0", If_Range='"stale"')[1], b"0123456789"
+        )
+
+    def test_ranges_are_not_gzipped(self):
+        etag = self.get(Accept_Encoding="gzip")[0]["ETag"]
+        response, body = self.get(
+            Range="bytes=2-4", If_Range=etag, Accept_Encoding="gzip"
+        )
+
+        self.assertFalse(etag.startswith("W/"))
+        self.assertEqual((response.status_code, body), (206, b"234"))
+        self.assertNotIn("Content-Encoding", response)
+
+
+class EncodingNegotiationTests(SimpleTestCase):
+    available = ("zstd", "br", "gzip", "identity")
+
+    def test_negotiate_encoding(self):
+        for header, expected in (
+            ("gzip, deflate, br, zstd", "zstd"),
+            ("gzip, br", "br"),
+            ("gzip", "gzip"),
+            ("", "identity"),
+            ("deflate", "identity"),
+            ("*", "zstd"),
+            ("zstd;q=0, br;q=0.5", "br"),
+            ("*;q=0, gzip", "gzip"),
+            ("ZSTD", "zstd"),
+            ("br;q=nonsense, gzip", "gzip"),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(negotiate_encoding(header, self.available), expected)
+
+    def test_only_available_encodings(self):
+        self.assertEqual(
+            negotiate_encoding("zstd, br", ("gzip", "identity")), "identity"
+        )
+
+
+class TextRenderingTests(SimpleTestCase):
+    renderer = HTMLRenderer([])
+
+    def emoji(self, unicode_emoji: str) -> str:
+        return self.renderer.get_emoji_tag(unicode_emoji)
+
+    def test_same_as_legacy(self):
+        for text in (
+            "",
+            "plain",
+            "<b>a & 'b' \"c\"</b>",
+            ":not_real: text",
+            "a:b:c",
+            "12:30 and 3:45",
+            ":grinning_face::grinning_face:",
+            ":grinning_face:grinning_face:",
+            "😀x😀",
+            # Keycaps, and the characters they start with on their own.
+            "#️⃣ 1️⃣ *️⃣ 1⃣ # 1 *",
+            # ZWJ sequences, skin tones and flags.
+            "👨\u200d👩\u200d👧 family",
+            "🏳️\u200d🌈",
+            "👍🏽 ok",
+            "🇺🇸🇫🇷",
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(
+                    self.renderer.flatten_text(text), legacy_flatten_text(text)
+                )
+
+    def test_escaping(self):
+        self.assertEqual(
+            self.renderer.flatten_text("<b>a & 'b' \"c\"</b>"),
+            "&lt;b&gt;a &amp; &#x27;b&#x27; &quot;c&quot;&lt;/b&gt;",
+        )
+
+    def test_zwj_sequences_are_one_emoji(self):
+        family = "👨\u200d👩\u200d👧"
+
+        self.assertEqual(self.renderer.flatten_text(family), self.emoji(family))
+
+    def test_unknown_shortcodes_before_real_ones(self):
+        # The legacy renderer left this alone, as it took `:grinning_face` as a
+        # shortcode too.
+        self.assertEqual(
+            self.renderer.flatten_text(":not_real:grinning_face:"),
+            ":not_real" + self.emoji("😀"),
+        )
+
+    def test_shortcodes_with_ampersands(self):
+        # The legacy renderer escaped the text first, so these never resolved.
+        self.assertEqual(
+            self.renderer.flatten_text(":Antigua_&_Barbuda:"), self.emoji("🇦🇬")
+        )
+
+
+class RouteStatsTests(BlogTestCase):
+    def get(self, **user):
+        if user:
+            self.client.force_login(User.objects.create(username="User", **user))
+
+        return self.client.get(reverse("route-stats"))
+
+    def test_anonymous_users_log_in(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response["Location"].startswith(reverse("admin:login")))
+
+    def test_staff_members(self):
+        self.assertEqual(self.get(is_staff=True).status_code, 403)
+
+    def test_superusers(self):
+        response = self.get(is_staff=True, is_superuser=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("reloads", response.json())
+
+
+class ReadOnlyRouterTests(SimpleTestCase):
+    router = ReadOnlyRouter()
+
+    def test_reads(self):
+        self.assertIsNone(self.router.db_for_read(Article))
+
+        with reading_only():
+            self.assertEqual(self.router.db_for_read(Article), "replica")
+            self.assertEqual(self.router.db_for_write(Article), "default")
+
+    def test_writes(self):
+        article = Article()
+        self.assertEqual(self.router.db_for_write(Article, instance=article), "default")
+
+        article._state.db = "replica"
+        self.assertEqual(self.router.db_for_write(Article, instance=article), "default")
+
+        # Instances of other databases (e.g. those of `bench_db`) stay there.
+        article._state.db = "bench-tuned"
+        self.assertIsNone(self.router.db_for_write(Article, instance=article))
+
+    def test_streamed_responses(self):
+        def stream():
+            yield self.router.db_for_read(Article)
+
+        @read_only
+        def view(request):
+            self.assertEqual(self.router.db_for_read(Article), "replica")
+
+            return StreamingHttpResponse(stream())
+
+        response = view(None)
+
+        self.assertIsNone(self.router.db_for_read(Article))
+        self.assertEqual(b"".join(response.streaming_content), b"replica")
+
+    def test_replica_is_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica", "blog"))
+        self.assertIsNone(self.router.allow_migrate("default", "blog"))
@@ -1,6 +1,8 @@
 from django.urls import path, register_converter
 
 from . import views, converters
+from .pagecache import cache_anonymous
+from .routers import read_only
 
 register_converter(converters.TwoDigitLeftPadIntConverter, "two_digit")
 register_converter(converters.FourDigitLeftPadIntConverter, "four_digit")
@@ -19,7 +21,12 @@ urlpatterns = [
         name="redirect_article",
     ),
     path("by-id/<b32:id>", views.redirect_article_id, name="article-by-id"),
+    path("by-id/<b32:id>/comments", views.get_comment_page, name="article-comments"),
     # path("", views.index, name="index"),
     # path("page/<int_nz:page>", views.index, name="index_page"),
-    path("", views.ArticleListView.as_view(), name="articles"),
+    path(
+        "",
+        cache_anonymous(read_only(views.ArticleListView.as_view())),
+        name="articles",
+    ),
 ]
@@ -1,20 +1,82 @@
+from collections.abc import AsyncIterator, Iterable, Iterator
+from datetime import datetime
 import hashlib
-import json
+import mimetypes
+from pathlib import Path
+import re
 from typing import Any, cast
+from urllib.parse import quote
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max
+from django.core.exceptions import PermissionDenied
+from django.core.files import File
+from django.core.paginator import InvalidPage
 from django.db.models.query import QuerySet
 from django.shortcuts import redirect
-from django.http import HttpRequest
-from django.shortcuts import get_object_or_404, render
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.http.response import HttpResponseBase
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import (
+    content_disposition_header,
+    http_date,
+    parse_http_date_safe,
+    quote_etag,
+)
+from django.utils.safestring import mark_safe
+from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.generic.list import ListView
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import AnonymousUser
 
-from blog.render import render_page
+from blog.cache import dump_json_ld, render_cache, seo_cache, with_json_ld_context
+from blog.dependencies import (
+    LIST_DEPENDENCY,
+    article_dependencies,
+    article_dependency,
+)
+from blog.intake import comment_intake
+from blog.pagecache import cache_anonymous, page_cache
+from blog.pagination import (
+    KeysetPage,
+    KeysetPaginator,
+    after_cursor,
+    encode_cursor,
+    listed_count,
+)
+from blog.render import collect_upload_idents, get_article_ir, iter_page
+from blog.render.executor import run_in_render_pool
+from blog.routers import read_only
+from blog.routes import route_table
 from kazani.models import User
-from .models import Article, Comment
+from .models import Article, Comment, Upload
 from .forms import CommentForm
 
 
+def get_list_dependencies(articles: Iterable[Article]) -> set[str]:
+    """What a list of articles (with prefetched tags) depends on."""
+
+    return set().union(
+        *(
+            article_dependencies(
+                article, tag_ids=[tag.pk for tag in article.tags.all()]
+            )
+            for article in articles
+        )
+    )
+
+
 class ArticleListView(ListView):
     """
     Displays a list of articles.
@@ -25,90 +87,413 @@ class ArticleListView(ListView):
 
     model = Article
     paginate_by = 10
-    ordering = "-created"
+    ordering = ("-created", "-id")
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        page_cache.add_tags(request, LIST_DEPENDENCY)
+
+        return super().get(request, *args, **kwargs)
 
     def get_queryset(self) -> QuerySet[Any]:
-        if (
+        # The SEO data and page cache dependencies of every article need these.
+        queryset = (
+            super()
+            .get_queryset()
+            .exclude(page_url="/")
+            .select_related("author")
+            .prefetch_related("tags")
+        )
+
+        if self.shows_hidden():
+            return queryset
+
+        return queryset.filter(is_hidden=False)
+
+    def shows_hidden(self) -> bool:
+        return (
             not isinstance(self.request.user, AnonymousUser)
             and cast(User, self.request.user).is_superuser
-        ):
-            return super().get_queryset().exclude(page_url="/")
+        )
+
+    def get_count(self, queryset: QuerySet[Any]) -> int:
+        if self.shows_hidden():
+            return queryset.count()
+
+        return listed_count.get()
+
+    def get_paginator(self, queryset: QuerySet[Any], *args: Any, **kwargs: Any) -> Any:
+        paginator = super().get_paginator(queryset, *args, **kwargs)
+        paginator.count = self.get_count(queryset)
+
+        return paginator
+
+    def paginate_queryset(self, queryset: QuerySet[Any], page_size: int) -> Any:
+        if settings.ARTICLE_LIST_PAGINATION != "keyset":
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(queryset, page_size, self.get_count(queryset))
+
+        try:
+            page = paginator.page(self.request.GET.get("after"))
+
+        except InvalidPage as e:
+            raise Http404(str(e)) from e
+
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_page_urls(self, page: Any) -> dict[str, str | None]:
+        """Paths of the first, previous, next, last and current page."""
+
+        first = reverse("articles")
 
-        return super().get_queryset().filter(is_hidden=False).exclude(page_url="/")
+        if isinstance(page, KeysetPage):
+            cursor = self.request.GET.get("after")
+
+            return {
+                "first": first if page.has_previous() else None,
+                "previous": (
+                    None
+                    if not page.has_previous()
+                    else (
+                        f"{first}?after={page.previous_cursor}"
+                        if page.previous_cursor
+                        else first
+                    )
+                ),
+                "next": (
+                    f"{first}?after={page.next_cursor}" if page.has_next() else None
+                ),
+                "last": None,
+                "canonical": f"{first}?after={cursor}" if cursor else first,
+            }
+
+        def page_url(number: int) -> str:
+            return first if number == 1 else f"{first}?page={number}"
+
+        return {
+            "first": first if page.has_previous() else None,
+            "previous": (
+                page_url(page.previous_page_number()) if page.has_previous() else None
+            ),
+            "next": page_url(page.next_page_number()) if page.has_next() else None,
+            "last": page_url(page.paginator.num_pages) if page.has_next() else None,
+            "canonical": page_url(page.number),
+        }
 
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         ctx = super().get_context_data(**kwargs)
 
-        ctx["seo"] = json.dumps(
+        if page_cache.is_enabled(self.request):
+            page_cache.add_tags(
+                self.request,
+                *get_list_dependencies(ctx["object_list"]),
+            )
+
+        header = dump_json_ld(
             {
                 "@context": "https://schema.org",
                 "@type": "Blog",
                 "title": "Kazani's Blog",
-                "blogPost": [
-                    article.get_seo(self.request) for article in ctx["object_list"]
-                ],
-            },
-            indent="\t",
+            }
         )
+        posts = seo_cache.get_many(list(ctx["object_list"]), self.request)
+
+        ctx["seo"] = f'{header[:-1]},"blogPost":[{",".join(posts)}]}}'
+
+        page = ctx["page_obj"]
+        ctx["page_urls"] = self.get_page_urls(page)
 
         ctx["title"] = "Articles"
-        if ctx["page_obj"].paginator.num_pages not in (0, 1):
-            ctx[
-                "title"
-            ] += f" - Page {ctx['page_obj'].number} of {ctx['page_obj'].paginator.num_pages}"
+        if isinstance(page, KeysetPage):
+            if page.has_previous():
+                ctx["title"] += f" - Older than {page[0].created:%Y-%m-%d}"
+
+        elif page.paginator.num_pages not in (0, 1):
+            ctx["title"] += f" - Page {page.number} of {page.paginator.num_pages}"
 
         return ctx
 
 
-def get_article(
-    request: HttpRequest, year: int, month: int, day: int, id: int, slug: str
-):  # pylint: disable=unused-argument,redefined-builtin
-    """
-    Returns a rendered article.
+# Placeholders in the rendered article template that the streamed content and
+# comments are spliced into.
+CONTENT_MARKER = mark_safe("<!-- kaz:content -->")
+COMMENTS_MARKER = mark_safe("<!-- kaz:comments -->")
 
-    TODO: templates
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Comments embedded in the article page, and loaded at a time after that.
+COMMENTS_PER_PAGE = 20
+
+
+async def get_comments(
+    article: Article, cursor: str | None = None
+) -> tuple[list[dict[str, Any]], str | None]:
+    """
+    A page of the approved comments of an article, newest first, and the cursor
+    of the next page.
     """
 
-    article = get_object_or_404(Article, id=id)
+    if not article.active_comment_count:
+        return [], None
 
-    seo = {"@context": "https://schema.org", **article.get_seo(request)}
+    queryset = article.comments.filter(active=True).order_by("-created", "-id")
 
-    if request.method == "POST":
-        comment_form = CommentForm(data=request.POST)
+    if cursor is not None:
+        queryset = queryset.filter(after_cursor(cursor))
 
-        if comment_form.is_valid():
-            new_comment: Comment = comment_form.save(commit=False)
-            new_comment.article = article
-            new_comment.save()
+    comments = [
+        comment
+        async for comment in queryset.values(
+            "id", "name", "created", "content", "email_hash"
+        )[: COMMENTS_PER_PAGE + 1]
+    ]
 
-    return render(
-        request,
+    if len(comments) <= COMMENTS_PER_PAGE:
+        return comments, None
+
+    last = comments[COMMENTS_PER_PAGE - 1]
+
+    return comments[:COMMENTS_PER_PAGE], encode_cursor(last["created"], last["id"])
+
+
+def render_comments(
+    article: Article, comments: list[dict[str, Any]], next_cursor: str | None
+) -> str:
+    return render_to_string(
+        "blog/comments.html",
+        {"article": article, "comments": comments, "next_cursor": next_cursor},
+    )
+
+
+def render_article_shell(
+    request: HttpRequest, article: Article, tags: list[tuple[Any, ...]]
+) -> str:
+    """
+    Renders the article page with placeholders for the content and comments.
+
+    Everything in here should be cheap, as nothing is sent before it's done.
+    """
+
+    return render_to_string(
         "blog/article.html",
         {
             "article": article,
-            "tags": article.tags.values_list,
-            "content": render_page(article.content, article),
-            "seo": json.dumps(seo, indent="\t"),
+            "tags": tags,
+            "content": CONTENT_MARKER,
+            "seo": with_json_ld_context(seo_cache.get(article, request)),
             "title": article.title,
             "head": article.head,
             "script": f"<script>{article.script}</script>",
             "comments_enabled": article.comments_enabled,
-            "unapproved_comments": len(article.comments.filter(active=False)),
-            "comments": [
-                {
-                    "name": comment.name,
-                    "created": comment.created,
-                    "content": comment.content,
-                    "email_hash": hashlib.md5(
-                        comment.email.encode("utf-8")
-                    ).hexdigest(),
-                }
-                for comment in article.comments.filter(active=True).order_by("-created")
-            ],
+            "unapproved_comments": article.pending_comment_count,
+            "comments": COMMENTS_MARKER,
         },
+        request,
+    )
+
+
+def take_chunks(chunks: Iterator[str], size: int) -> str:
+    """Joins chunks until at least `size` characters are collected or `chunks` runs out."""
+
+    taken = []
+    length = 0
+
+    for chunk in chunks:
+        taken.append(chunk)
+        length += len(chunk)
+
+        if length >= size:
+            break
+
+    return "".join(taken)
+
+
+async def stream_article(
+    request: HttpRequest, article: Article
+) -> StreamingHttpResponse:
+    """
+    Streams a rendered article.
+
+    The page up to the content (`<head>`, navigation and article header) is
+    sent right away, followed by the rendered content and then the comments.
+    """
+
+    tags = [(tag.pk, tag.name, tag.slug) for tag in article.tags.all()]
+    shell = await sync_to_async(render_article_shell)(request, article, tags)
+
+    before_content, after_content = shell.split(CONTENT_MARKER, 1)
+    before_comments, _, after_comments = after_content.partition(COMMENTS_MARKER)
+
+    async def stream() -> AsyncIterator[str]:
+        yield before_content
+
+        chunks = iter_page(article.content, article)
+
+        while chunk := await run_in_render_pool(take_chunks, chunks, STREAM_CHUNK_SIZE):
+            yield chunk
+
+        yield before_comments
+
+        if article.comments_enabled:
+            comments, next_cursor = await get_comments(article)
+
+            yield await run_in_render_pool(
+                render_comments, article, comments, next_cursor
+            )
+
+            yield after_comments
+
+    return StreamingHttpResponse(stream(), content_type="text/html; charset=utf-8")
+
+
+async def get_article_etag(
+    request: HttpRequest, article: Article, dependencies: set[str]
+) -> str:
+    """
+    A weak ETag for the article page as seen by this request.
+
+    Covers everything that changes the page: the article, its rendered content,
+    its tags and author, the comments and who is looking at it (superusers get
+    edit links and everyone gets their own CSRF token). Changes that don't touch
+    the article row (e.g. editing a comment or renaming a tag) bump the versions
+    of the page's `dependencies`.
+
+    Weak, because the CSRF token in the comment form is masked differently on
+    every render, so the bytes differ even when the page is the same.
+    """
+
+    comments = await article.comments.filter(active=True).aaggregate(
+        count=Count("pk"), latest=Max("pk")
+    )
+    versions = await sync_to_async(page_cache.tag_versions)(dependencies)
+    # Reads the upload generation from the (file-based) render cache.
+    fingerprint = await sync_to_async(render_cache.fingerprint)(
+        article.content, article.content_type
+    )
+    user = await request.auser()
+
+    parts = [
+        article.pk,
+        article.modified.isoformat(),
+        fingerprint,
+        sorted((tag.pk, tag.name) for tag in article.tags.all()),
+        article.author_id,
+        article.author.username if article.author else "",
+        comments["count"],
+        comments["latest"],
+        article.active_comment_count,
+        article.pending_comment_count,
+        sorted(versions.items()),
+        user.pk,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""),
+    ]
+
+    digest = hashlib.sha256(":".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+    return f"W/{quote_etag(digest)}"
+
+
+def get_article_dependencies(article: Article) -> set[str]:
+    """What the page of an article depends on, see `blog.dependencies`."""
+
+    return article_dependencies(
+        article,
+        idents=collect_upload_idents(get_article_ir(article)),
+        tag_ids=[tag.pk for tag in article.tags.all()],
     )
 
 
+@cache_anonymous
+@read_only
+async def get_article(
+    request: HttpRequest, year: int, month: int, day: int, id: int, slug: str
+):  # pylint: disable=unused-argument,redefined-builtin
+    """
+    Returns a rendered article.
+
+    TODO: templates
+    """
+
+    article = await aget_object_or_404(
+        Article.objects.select_related("author").prefetch_related("tags"), id=id
+    )
+
+    if request.method == "POST":
+        comment_form = CommentForm(data=request.POST)
+
+        if await sync_to_async(comment_form.is_valid)():
+            new_comment: Comment = comment_form.save(commit=False)
+            new_comment.article = article
+            await sync_to_async(comment_intake.submit)(new_comment)
+
+            # Post/Redirect/Get, so reloading doesn't submit the comment again.
+            return HttpResponseRedirect(f"{request.path}#comments")
+
+        return await stream_article(request, article)
+
+    dependencies = await run_in_render_pool(get_article_dependencies, article)
+
+    if page_cache.is_enabled(request):
+        await sync_to_async(page_cache.add_tags)(request, *dependencies)
+
+    etag = await get_article_etag(request, article, dependencies)
+
+    if (response := get_conditional_response(request, etag=etag)) is not None:
+        return response
+
+    response = await stream_article(request, article)
+    response["ETag"] = etag
+
+    return response
+
+
+@cache_anonymous
+@read_only
+async def get_comment_page(
+    request: HttpRequest, id: int
+) -> HttpResponse:  # pylint: disable=redefined-builtin
+    """A page of comments after the `after` cursor, for the "More comments" link."""
+
+    article = await aget_object_or_404(Article, id=id, comments_enabled=True)
+
+    if page_cache.is_enabled(request):
+        await sync_to_async(page_cache.add_tags)(
+            request, article_dependency(article.pk)
+        )
+
+    try:
+        comments, next_cursor = await get_comments(article, request.GET.get("after"))
+
+    except InvalidPage as e:
+        raise Http404(str(e)) from e
+
+    return HttpResponse(
+        await run_in_render_pool(render_comments, article, comments, next_cursor)
+    )
+
+
+@ensure_csrf_cookie
+def csrf_cookie(
+    request: HttpRequest,
+) -> HttpResponse:  # pylint: disable=unused-argument
+    "Sets the CSRF cookie for pages that come from the page cache or a static export."
+
+    return HttpResponse(status=204)
+
+
+@staff_member_required
+def route_stats(
+    request: HttpRequest,
+) -> JsonResponse:
+    "Counters of the custom path lookup table of the process handling the request."
+
+    # Anyone else is sent to the admin login.
+    if not cast(User, request.user).is_superuser:
+        raise PermissionDenied
+
+    return JsonResponse(route_table.get_stats())
+
+
 def redirect_date_article(
     request: HttpRequest, year: int, month: int, day: int, id: int
 ):  # pylint: disable=unused-argument,redefined-builtin
@@ -123,3 +508,147 @@ def redirect_article_id(
     "Redirect to the full article url from just the id."
 
     return redirect(get_object_or_404(Article, id=id).get_absolute_url())
+
+
+UPLOAD_BLOCK_SIZE = 256 * 1024
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parses a `Range` header into a `(start, end)` byte range, end exclusive.
+
+    Returns None if the header should be ignored (malformed or more than one
+    range) and raises ValueError if the range can't be satisfied.
+    """
+
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+
+    if match is None or match[1] == match[2] == "":
+        return None
+
+    if match[1] == "":
+        if (length := int(match[2])) == 0:
+            raise ValueError("empty suffix range")
+
+        return max(size - length, 0), size
+
+    start = int(match[1])
+
+    if match[2] and int(match[2]) < start:
+        return None
+
+    if start >= size:
+        raise ValueError("range starts after the end of the file")
+
+    return start, min(int(match[2]) + 1 if match[2] else size, size)
+
+
+def if_range_matches(
+    request: HttpRequest, etag: str | None, last_modified: datetime
+) -> bool:
+    """Whether the `If-Range` precondition (if any) allows serving a range."""
+
+    if (if_range := request.headers.get("If-Range")) is None:
+        return True
+
+    if if_range.startswith(('"', "W/")):
+        # Weak ETags never match for ranges.
+        return etag is not None and not if_range.startswith("W/") and if_range == etag
+
+    return parse_http_date_safe(if_range) == int(last_modified.timestamp())
+
+
+async def read_file(file: File, start: int, length: int) -> AsyncIterator[bytes]:
+    """Reads `length` bytes from `file` starting at `start`, closing it afterwards."""
+
+    read = sync_to_async(file.read, thread_sensitive=False)
+
+    try:
+        await sync_to_async(file.seek, thread_sensitive=False)(start)
+
+        while length > 0 and (block := await read(min(UPLOAD_BLOCK_SIZE, length))):
+            length -= len(block)
+
+            yield block
+
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+async def serve_upload(request: HttpRequest, upload: Upload) -> HttpResponseBase:
+    """
+    Serves the file of an upload.
+
+    Handles conditional and range requests, or hands the transfer off to the
+    web server if `UPLOAD_SENDFILE_HEADER` is set.
+    """
+
+    storage = upload.content.storage
+    name = upload.content.name
+
+    etag = quote_etag(upload.content_hash) if upload.content_hash else None
+    last_modified = await sync_to_async(storage.get_modified_time)(name)
+
+    if (
+        response := get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp())
+        )
+    ) is not None:
+        return response
+
+    content_type = (
+        upload.mime_type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+    )
+
+    if settings.UPLOAD_SENDFILE_HEADER is not None:
+        # The web server takes care of ranges.
+        response = HttpResponse(content_type=content_type)
+
+        if settings.UPLOAD_SENDFILE_HEADER == "X-Accel-Redirect":
+            response["X-Accel-Redirect"] = settings.UPLOAD_SENDFILE_PREFIX + quote(name)
+
+        else:
+            response[settings.UPLOAD_SENDFILE_HEADER] = upload.content.path
+
+    else:
+        size = (
+            upload.size
+            if upload.size is not None
+            else await sync_to_async(storage.size)(name)
+        )
+        start, end = 0, size
+
+        if (range_header := request.headers.get("Range")) is not None and (
+            if_range_matches(request, etag, last_modified)
+        ):
+            try:
+                byte_range = parse_range(range_header, size)
+
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+
+                return response
+
+            if byte_range is not None:
+                start, end = byte_range
+
+        file = await sync_to_async(upload.content.open)("rb")
+        response = StreamingHttpResponse(
+            read_file(file, start, end - start), content_type=content_type
+        )
+        response["Content-Length"] = str(end - start)
+
+        if (start, end) != (0, size):
+            response.status_code = 206
+            response["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+
+        response["Accept-Ranges"] = "bytes"
+
+    response["Content-Disposition"] = content_disposition_header(False, Path(name).name)
+    response["Last-Modified"] = http_date(last_modified.timestamp())
+
+    if etag is not None:
+        response["ETag"] = etag
+
+    return response
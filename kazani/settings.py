@@ -53,7 +53,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "django.middleware.gzip.GZipMiddleware",
+    "blog.pagecache.TextGZipMiddleware",
+    "blog.pagecache.PageCacheMiddleware",
     "django_minify_html.middleware.MinifyHtmlMiddleware",
 ]
 
@@ -85,8 +86,71 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Under ASGI (uvicorn) every request runs its queries in a thread of its
+        # own, so persistent connections would only pile up. Set this to e.g. 600
+        # when serving with a WSGI server, whose threads are reused.
+        "CONN_MAX_AGE": 0,
+        "OPTIONS": {
+            # Seconds to wait for another connection to finish writing (the busy
+            # timeout) before failing with "database is locked".
+            "timeout": 20,
+        },
     }
 }
+DATABASES["replica"] = {
+    **DATABASES["default"],
+    # The same file opened read-only, for the public pages (see `blog.routers`).
+    # With a database server, point this at a replica instead.
+    "NAME": f"{(BASE_DIR / 'db.sqlite3').as_uri()}?mode=ro",
+    "TEST": {"MIRROR": "default"},
+}
+
+DATABASE_ROUTERS = ["blog.routers.ReadOnlyRouter"]
+# Where views marked with `blog.routers.read_only` read from.
+READ_ONLY_DATABASE = "replica"
+
+# Applied to every new SQLite connection, see `blog.signals.configure_sqlite`.
+SQLITE_PRAGMAS = {
+    # Readers don't block writers and writers don't block readers.
+    "journal_mode": "WAL",
+    # With WAL, only the last transactions can be lost on power loss (never on a
+    # crash of the server), and commits don't wait for the disk.
+    "synchronous": "NORMAL",
+    # Read the database through memory-mapped I/O instead of read() calls.
+    "mmap_size": 256 * 1024 * 1024,
+    # Negative sizes are in KiB, so 64 MiB of page cache per connection.
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Rendered article HTML, see `blog.cache`.
+    "render": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache" / "render",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+    # Whole pages served to anonymous readers, see `blog.pagecache`.
+    "pages": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache" / "pages",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+}
+
+# Hosts pages are cached for, in the format of `ALLOWED_HOSTS` (add the domain
+# the site is served from). Requests for any other host are never cached, so
+# made-up `Host` headers can't fill the page cache.
+PAGE_CACHE_HOSTS = ["localhost", "127.0.0.1", "[::1]"]
 
 
 # Password validation
@@ -146,3 +210,31 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
 AUTH_USER_MODEL = "kazani.User"
+
+# Threads used by async views for rendering articles, see `blog.render.executor`.
+RENDER_WORKERS = 4
+
+# Hand upload downloads off to the web server instead of streaming them through
+# Django: None, "X-Accel-Redirect" (NGINX, or Caddy with `handle_response`) or
+# "X-Sendfile" (Apache, lighttpd).
+UPLOAD_SENDFILE_HEADER: str | None = None
+# Internal location the web server serves `MEDIA_ROOT` from for X-Accel-Redirect.
+UPLOAD_SENDFILE_PREFIX = "/_uploads/"
+
+# Where `manage.py export_site` writes the static copy of the site.
+EXPORT_ROOT = BASE_DIR / "export"
+
+# How the article list is paginated: "offset" (`?page=2`) or "keyset"
+# (`?after=<cursor>`, see `blog.pagination`), which stays fast for deep pages.
+ARTICLE_LIST_PAGINATION = "offset"
+
+# Submitted comments are queued here and added to the database in the
+# background, see `blog.intake`.
+COMMENT_INTAKE_PATH = BASE_DIR / "comment-intake.sqlite3"
+COMMENT_INTAKE_WORKER = True
+# Seconds to wait for more comments before adding them, and how many to add at once.
+COMMENT_INTAKE_DELAY = 1.0
+COMMENT_INTAKE_BATCH_SIZE = 100
+# Seconds after which comments claimed by a process are taken to be left behind
+# by it (e.g. because it was stopped), and are claimed again.
+COMMENT_INTAKE_CLAIM_TIMEOUT = 60.0
@@ -15,37 +15,54 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
-import subprocess
-from pathlib import Path
+from typing import Any
 
+from asgiref.sync import sync_to_async
 from django.contrib.sitemaps.views import sitemap
 from django.contrib.sitemaps import Sitemap
 from django.contrib.syndication.views import Feed
 from django.contrib import admin
-from django.http import FileResponse, HttpRequest, HttpResponse
+from django.http import Http404, HttpRequest, HttpResponse
+from django.http.response import HttpResponseBase
 from django.urls import path, re_path, include, register_converter, reverse
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404
 from django.conf.urls.static import static
 
-from blog.views import get_article
+from blog.views import csrf_cookie, get_article, route_stats, serve_upload
 from blog.models import Article, Upload
+from blog.dependencies import LIST_DEPENDENCY, ROUTES_DEPENDENCY, summary_dependency
+from blog.pagecache import cache_anonymous, page_cache
+from blog.routers import read_only
+from blog.routes import route_table
 from blog import converters
 from kazani import settings
 
 # from kazani import views
 
 
-def get_root(request: HttpRequest) -> HttpResponse:
-    try:
-        article = Article.objects.get(page_url="/")
-
-    except Article.DoesNotExist:
+@cache_anonymous
+@read_only
+async def get_root(request: HttpRequest) -> HttpResponse:
+    if (route := await route_table.aresolve("/")) is None or route.kind != "article":
         return HttpResponse(
             f'No homepage has been defined. <a href="{request.scheme}://{request.get_host()}{reverse("admin:index")}blog/article/">Please make one.</a>',
             status=404,
         )
 
-    return get_article(request, 0, 0, 0, article.id, "")
+    await sync_to_async(page_cache.add_tags)(request, ROUTES_DEPENDENCY)
+
+    return await get_article(request, 0, 0, 0, route.id, "")
+
+
+def add_summary_tags(request: HttpRequest, articles) -> None:
+    """Records that the page lists `articles`, and shows a summary of each."""
+
+    if page_cache.is_enabled(request):
+        page_cache.add_tags(
+            request,
+            LIST_DEPENDENCY,
+            *map(summary_dependency, articles.values_list("pk", flat=True)),
+        )
 
 
 class BlogSitemap(Sitemap):
@@ -58,11 +75,22 @@ class BlogSitemap(Sitemap):
         return obj.created
 
 
+@cache_anonymous
+@read_only
+def get_sitemap(request: HttpRequest, **kwargs: Any) -> HttpResponse:
+    add_summary_tags(request, BlogSitemap().items())
+
+    return sitemap(request, **kwargs)
+
+
 class BlogFeed(Feed):
     title = "Kazani.dev's blog"
     link = "/articles/"
     description = "Kazani's personal blog. I talk about Computer Science, Linux, and other things here!"
 
+    def get_object(self, request: HttpRequest, *args: Any, **kwargs: Any) -> None:
+        add_summary_tags(request, self.items())
+
     def items(self):
         return Article.objects.order_by("-created").filter(is_hidden=False)
 
@@ -76,40 +104,43 @@ class BlogFeed(Feed):
 register_converter(converters.Base32Converter, "b32")
 
 
-def get_page(request: HttpRequest) -> HttpResponse | FileResponse:
-    if (
-        article := Article.objects.filter(
-            page_url=request.get_full_path().rstrip("/") + "/"
-        ).first()
-    ) is not None:
-        return get_article(
+@cache_anonymous
+@read_only
+async def get_page(request: HttpRequest) -> HttpResponseBase:
+    route = await route_table.aresolve(request.get_full_path())
+
+    if route is None:
+        raise Http404()
+
+    if route.kind == "article":
+        await sync_to_async(page_cache.add_tags)(request, ROUTES_DEPENDENCY)
+
+        return await get_article(
             request,
             0,
             0,
             0,
-            article.id,
+            route.id,
             "",
         )
 
-    upload = get_object_or_404(Upload, path=request.get_full_path().rstrip("/"))
+    upload = await aget_object_or_404(Upload, pk=route.id)
 
-    return FileResponse(
-        upload.content.open("rb"),
-        subprocess.check_output(["file", "-ib", upload.content.path]).strip(),
-        filename=Path(upload.content.name).name,
-    )
+    return await serve_upload(request, upload)
 
 
 urlpatterns = [
+    path("kaz/csrf/", csrf_cookie, name="csrf-cookie"),
+    path("kaz/__admin_/stats/routes/", route_stats, name="route-stats"),
     path("kaz/__admin_/", admin.site.urls),
     path("articles/", include("blog.urls")),
     path(
         "sitemap.xml",
-        sitemap,
+        get_sitemap,
         {"sitemaps": {"blog": BlogSitemap}},
         name="django.contrib.sitemaps.views.sitemap",
     ),
-    path("feed/", BlogFeed()),
+    path("feed/", cache_anonymous(read_only(BlogFeed()))),
     # path("profiles/<b32:id>", views.profile_page, name="profile"),
     path("", get_root, name="index"),
     re_path("^.*$", get_page),